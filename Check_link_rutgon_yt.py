@@ -1,13 +1,17 @@
 import os
 import re
+import sys
 import csv
-import io
 import time
 import smtplib
+import threading
+import concurrent.futures
+from collections import deque, Counter, OrderedDict
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
-from googleapiclient.discovery import build
+from youtube_quota import build_youtube, QuotaExhausted, log_quota_report
+from phase_timing import record_phase, summarize_timing, format_timing_summary, log_timing_report, export_timing_json
 
 # --- CẤU HÌNH ---
 API_KEY = os.environ.get('YOUTUBE_API_KEY')
@@ -15,10 +19,28 @@ EMAIL_USER = os.environ.get('EMAIL_USER')
 EMAIL_PASS = os.environ.get('EMAIL_PASS')
 EMAIL_TO = os.environ.get('EMAIL_TO')
 
-youtube = build('youtube', 'v3', developerKey=API_KEY)
+# Client googleapiclient không an toàn khi dùng chung giữa các thread -> mỗi thread 1 client
+_youtube_local = threading.local()
+
+# Nguồn URL: file txt (mỗi dòng 1 URL, bỏ qua dòng trống và dòng '#'), '-' để đọc từ stdin,
+# hoặc PLAYLIST_ID để lấy toàn bộ video của 1 playlist. Có thể truyền qua dòng lệnh:
+#   python Check_link_rutgon_yt.py urls.txt | python Check_link_rutgon_yt.py - | python Check_link_rutgon_yt.py --playlist PLxxx
+# Để trống cả 2 thì dùng danh sách YOUTUBE_URLS bên dưới
+URL_SOURCE = os.environ.get('URL_SOURCE', '')
+PLAYLIST_ID = os.environ.get('PLAYLIST_ID', '')
+API_CHUNK_SIZE = 50  # videos().list nhận tối đa 50 ID mỗi lượt
+# Số nhóm 50 ID gọi API song song, và khoảng cách tối thiểu (giây) giữa 2 lần gửi request để không dồn dập API
+CHECK_CONCURRENCY = int(os.environ.get('CHECK_CONCURRENCY', '4'))
+CHECK_MIN_INTERVAL = float(os.environ.get('CHECK_MIN_INTERVAL', '0.1'))
+# Giới hạn RAM khi input rất dài: số kết quả ID nhớ lại cho URL trùng (cũ nhất bị bỏ, gặp lại thì gọi API lần nữa),
+# và số dòng chờ ghi tối đa (vượt mức thì gửi luôn nhóm đang gom dù chưa đủ 50 ID)
+CHECK_RESULT_CACHE_SIZE = int(os.environ.get('CHECK_RESULT_CACHE_SIZE', '100000'))
+CHECK_MAX_PENDING = int(os.environ.get('CHECK_MAX_PENDING', '5000'))
+_rate_lock = threading.Lock()
+_next_request_at = 0.0
 
 # --- DANH SÁCH URL INPUT ---
-# Bạn có thể dán 300 URL của bạn vào mảng này, hoặc viết hàm đọc từ file txt/csv tùy ý
+# Danh sách mặc định khi không chỉ định URL_SOURCE / PLAYLIST_ID
 YOUTUBE_URLS = [
     "https://www.youtube.com/watch?v=qbq__igQSR0",
 "https://www.youtube.com/watch?v=7wiriULLN8g",
@@ -227,103 +249,195 @@ YOUTUBE_URLS = [
 ]
 
 # --- BIẾN LƯU KẾT QUẢ ---
-CSV_DATA = []
+# Dòng CSV được ghi thẳng xuống file (không giữ toàn bộ kết quả trong RAM)
+REPORT_DIR = os.environ.get('REPORT_DIR', 'reports')
+CSV_PATH = os.path.join(REPORT_DIR, "Ket_qua_kiem_tra_trang_thai_video.csv")
 CSV_HEADER = ['STT', 'URL Video', 'Trạng thái', 'Tiêu đề (Nếu có)', 'Chi tiết trạng thái']
 
 def log(message):
     print(message, flush=True)
 
+def get_youtube():
+    client = getattr(_youtube_local, 'client', None)
+    if client is None:
+        client = build_youtube(API_KEY)
+        _youtube_local.client = client
+    return client
+
+def wait_rate_limit():
+    """Giữ khoảng cách CHECK_MIN_INTERVAL giữa các lần gửi request (dùng chung cho mọi thread)"""
+    global _next_request_at
+    with _rate_lock:
+        now = time.monotonic()
+        delay = _next_request_at - now
+        _next_request_at = max(now, _next_request_at) + CHECK_MIN_INTERVAL
+    if delay > 0: time.sleep(delay)
+
 def extract_video_id(url):
     """Trích xuất Video ID từ URL YouTube công thức chung"""
     parsed_id = re.search(r'(?:v=|\/v\/|embed\/|youtu\.be\/|\/shorts\/|^)([a-zA-Z0-9_-]{11})', url)
     return parsed_id.group(1) if parsed_id else None
 
-def check_videos_status(urls):
-    """Kiểm tra trạng thái hàng loạt video bằng cách gom nhóm 50 ID/request"""
-    video_map = {}
-    id_to_url = {}
-    
-    # Bước 1: Trích xuất ID và lọc các URL hợp lệ
-    for url in urls:
-        v_id = extract_video_id(url)
-        if v_id:
-            id_to_url[v_id] = url
-            # Mặc định ban đầu giả định là bị xóa hoặc sai ID, sẽ cập nhật lại khi API trả về dữ liệu
-            video_map[v_id] = {
-                'url': url,
-                'status': 'Đã xóa / Không tồn tại',
-                'title': 'N/A',
-                'privacy': 'N/A'
-            }
-        else:
-            CSV_DATA.append([len(CSV_DATA) + 1, url, 'URL Không hợp lệ', 'N/A', 'Không parse được ID'])
-
-    video_ids = list(id_to_url.keys())
-    log(f"Tổng số ID hợp lệ cần check: {len(video_ids)}")
-
-    # Bước 2: Gom nhóm bốc đầu 50 ID mỗi lượt gửi lên API để tiết kiệm quota
-    for i in range(0, len(video_ids), 50):
-        chunk = video_ids[i:i+50]
-        chunk_str = ','.join(chunk)
-        
+def iter_input_urls():
+    """Đọc URL theo luồng từ nguồn đã cấu hình (file / stdin / playlist / danh sách mặc định), không nạp hết vào RAM"""
+    if PLAYLIST_ID:
+        yield from iter_playlist_urls(PLAYLIST_ID)
+        return
+    if not URL_SOURCE:
+        yield from YOUTUBE_URLS
+        return
+
+    source = sys.stdin if URL_SOURCE == '-' else open(URL_SOURCE, encoding='utf-8-sig')
+    try:
+        for line in source:
+            url = line.strip()
+            if url and not url.startswith('#'): yield url
+    finally:
+        if source is not sys.stdin: source.close()
+
+def iter_playlist_urls(playlist_id):
+    """Duyệt playlist theo từng trang 50 video, trả về URL watch của từng video"""
+    next_page_token = None
+    while True:
         try:
-            # Gọi part='status,snippet' để check cả quyền riêng tư lẫn tiêu đề
-            request = youtube.videos().list(id=chunk_str, part='status,snippet')
-            response = request.execute()
-            
-            # Cập nhật thông tin cho các video tìm thấy (đang tồn tại công khai hoặc hạn chế công khai)
-            found_ids = []
-            for item in response.get('items', []):
-                v_id = item['id']
-                found_ids.append(v_id)
-                
-                title = item['snippet']['title']
-                privacy_status = item['status']['privacyStatus'] # public, unlisted, hoặc private
-                
-                if privacy_status == 'public':
-                    status_text = 'Đang hoạt động'
-                    detail_text = 'Công khai (Public)'
-                elif privacy_status == 'unlisted':
-                    status_text = 'Hạn chế'
-                    detail_text = 'Không công khai (Unlisted)'
-                elif privacy_status == 'private':
-                    status_text = 'Bị ẩn'
-                    detail_text = 'Riêng tư (Private)'
-                else:
-                    status_text = 'Không xác định'
-                    detail_text = privacy_status
-                    
-                video_map[v_id] = {
-                    'url': id_to_url[v_id],
-                    'status': status_text,
-                    'title': title,
-                    'privacy': detail_text
-                }
-                
-        except Exception as e:
-            log(f"Lỗi khi check nhóm {i}-{i+50}: {e}")
-
-    # Bước 3: Đổ dữ liệu vào bảng CSV_DATA theo đúng thứ tự
-    for v_id, info in video_map.items():
-        CSV_DATA.append([
-            len(CSV_DATA) + 1,
-            info['url'],
-            info['status'],
-            info['title'],
-            info['privacy']
-        ])
-
-def send_email_with_csv(total_count):
+            pl_response = get_youtube().playlistItems().list(
+                playlistId=playlist_id, part='contentDetails', maxResults=50, pageToken=next_page_token
+            ).execute()
+        except QuotaExhausted as e:
+            # Vẫn gửi báo cáo phần đã đọc được, phần còn lại của playlist chạy lại sau
+            log(f"Hết quota khi đọc playlist {playlist_id}, dừng đọc tiếp: {e}")
+            return
+        for item in pl_response.get('items', []):
+            yield f"https://www.youtube.com/watch?v={item['contentDetails']['videoId']}"
+
+        next_page_token = pl_response.get('nextPageToken')
+        if not next_page_token: break
+
+def parse_privacy_status(privacy_status):
+    """Quy đổi privacyStatus của API sang (trạng thái, chi tiết) hiển thị trong báo cáo"""
+    if privacy_status == 'public':
+        return 'Đang hoạt động', 'Công khai (Public)'
+    if privacy_status == 'unlisted':
+        return 'Hạn chế', 'Không công khai (Unlisted)'
+    if privacy_status == 'private':
+        return 'Bị ẩn', 'Riêng tư (Private)'
+    return 'Không xác định', privacy_status
+
+def check_video_chunk(video_ids):
+    """Gọi videos().list cho 1 nhóm tối đa 50 ID, trả về {ID: (trạng thái, tiêu đề, chi tiết)} cho mọi ID trong nhóm"""
+    # Mặc định giả định là bị xóa hoặc sai ID, sẽ cập nhật lại khi API trả về dữ liệu
+    results = dict.fromkeys(video_ids, ('Đã xóa / Không tồn tại', 'N/A', 'N/A'))
+    try:
+        wait_rate_limit()
+        # Gọi part='status,snippet' để check cả quyền riêng tư lẫn tiêu đề
+        request = get_youtube().videos().list(id=','.join(video_ids), part='status,snippet')
+        response = request.execute()
+
+        # Video tìm thấy là đang tồn tại (công khai, không công khai hoặc riêng tư)
+        for item in response.get('items', []):
+            status_text, detail_text = parse_privacy_status(item['status']['privacyStatus'])
+            results[item['id']] = (status_text, item['snippet']['title'], detail_text)
+
+    except QuotaExhausted as e:
+        # Không có dữ liệu thì không được báo là "Đã xóa" -> đánh dấu chưa kiểm tra để chạy lại sau
+        log(f"Hết quota khi check nhóm {video_ids[0]}..{video_ids[-1]}: {e}")
+        return dict.fromkeys(video_ids, ('Chưa kiểm tra', 'N/A', 'Hết quota API'))
+    except Exception as e:
+        log(f"Lỗi khi check nhóm {video_ids[0]}..{video_ids[-1]}: {e}")
+    return results
+
+def check_videos_status(urls, csv_file):
+    """Kiểm tra trạng thái hàng loạt video theo luồng: đủ 50 ID mới là gửi 1 nhóm lên API (tối đa CHECK_CONCURRENCY nhóm
+    chạy song song), kết quả ghi vào csv_file đúng thứ tự input, mỗi URL 1 dòng kể cả URL trùng. Trả về số dòng đã ghi."""
+    csv_writer = csv.writer(csv_file)
+    row_count = 0
+    # ID -> kết quả, để URL trùng video (vd: cùng ID khác tham số &list=) dùng lại kết quả mà không gọi API lần nữa.
+    # Giữ theo LRU tối đa CHECK_RESULT_CACHE_SIZE ID, ID còn dòng chờ ghi (waiting) thì không bị bỏ
+    results = OrderedDict()
+    waiting = Counter()
+    checked_count = 0
+    # ID -> nhóm chứa ID đó, chỉ giữ trong lúc nhóm chưa ghi xong
+    id_to_chunk = {}
+    # Các dòng chờ ghi theo thứ tự input: (url, ID hoặc None nếu URL lỗi)
+    pending = deque()
+    in_flight = deque()
+    chunk = {'ids': [], 'future': None}
+    chunk_count = 0
+
+    def write_row(url, status, title, detail):
+        nonlocal row_count
+        started = time.perf_counter()
+        row_count += 1
+        csv_writer.writerow([row_count, url, status, title, detail])
+        record_phase("csv.row", time.perf_counter() - started)
+
+    def drain(block=False):
+        """Ghi các dòng đầu hàng đợi đã có kết quả; block=True thì chờ nhóm cũ nhất đang chạy xong trước"""
+        nonlocal checked_count
+        if block: in_flight[0]['future'].result()
+        while in_flight and in_flight[0]['future'].done():
+            done_chunk = in_flight.popleft()
+            results.update(done_chunk['future'].result())
+            checked_count += len(done_chunk['ids'])
+            for v_id in done_chunk['ids']:
+                if id_to_chunk.get(v_id) is done_chunk: del id_to_chunk[v_id]
+        while pending:
+            url, v_id = pending[0]
+            if v_id is None:
+                write_row(url, 'URL Không hợp lệ', 'N/A', 'Không parse được ID')
+            elif v_id in results:
+                write_row(url, *results[v_id])
+                results.move_to_end(v_id)
+                waiting[v_id] -= 1
+                if not waiting[v_id]: del waiting[v_id]
+            else:
+                break
+            pending.popleft()
+        while len(results) > CHECK_RESULT_CACHE_SIZE and next(iter(results)) not in waiting:
+            results.popitem(last=False)
+        csv_file.flush()
+
+    def submit_chunk():
+        nonlocal chunk, chunk_count
+        chunk['future'] = executor.submit(check_video_chunk, chunk['ids'])
+        in_flight.append(chunk)
+        chunk = {'ids': [], 'future': None}
+        chunk_count += 1
+        if chunk_count % 20 == 0: log(f"Đã gửi {chunk_count} nhóm ({checked_count + len(id_to_chunk)} ID), ghi {row_count} dòng")
+        # Giới hạn số nhóm đang chạy -> số dòng chờ ghi (và RAM) không tăng theo độ dài input
+        drain(block=len(in_flight) >= CHECK_CONCURRENCY)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=CHECK_CONCURRENCY) as executor:
+        for url in urls:
+            v_id = extract_video_id(url)
+            if v_id and v_id not in results and v_id not in id_to_chunk:
+                id_to_chunk[v_id] = chunk
+                chunk['ids'].append(v_id)
+            pending.append((url, v_id))
+            if v_id: waiting[v_id] += 1
+            if len(chunk['ids']) >= API_CHUNK_SIZE: submit_chunk()
+            elif len(pending) >= CHECK_MAX_PENDING:
+                # Nhiều URL trùng ID của nhóm chưa đủ 50 -> gửi nhóm dở, hoặc chờ nhóm đang chạy để ghi bớt dòng
+                if chunk['ids']: submit_chunk()
+                elif in_flight: drain(block=True)
+                else: drain()
+            elif not in_flight: drain()
+
+        if chunk['ids']: submit_chunk()
+        while in_flight: drain(block=True)
+        drain()
+
+    log(f"Tổng số ID hợp lệ đã check: {checked_count}")
+    return row_count
+
+def send_email_with_csv(total_count, csv_path):
     msg = MIMEMultipart()
     msg['From'] = EMAIL_USER
     msg['To'] = EMAIL_TO
     msg['Subject'] = f"[Hệ thống] Kết quả kiểm tra trạng thái {total_count} URL Video"
 
-    csv_buffer = io.StringIO()
-    csv_writer = csv.writer(csv_buffer)
-    csv_writer.writerow(CSV_HEADER)
-    csv_writer.writerows(CSV_DATA)
-    csv_bytes = csv_buffer.getvalue().encode('utf-8-sig')
+    with open(csv_path, 'rb') as f:
+        csv_bytes = f.read()
     
     filename = "Ket_qua_kiem_tra_trang_thai_video.csv"
     attachment = MIMEApplication(csv_bytes, Name=filename)
@@ -333,35 +447,60 @@ def send_email_with_csv(total_count):
     body = (f"Chào bạn,\n\nHệ thống đã hoàn tất quét danh sách {total_count} đường link YouTube của bạn.\n"
             f"Kết quả phân loại trạng thái chi tiết (Hoạt động, Riêng tư, Đã xóa) đã được đính kèm trong file CSV bên dưới.\n"
             f"File đã xử lý chống lỗi font, bạn có thể mở trực tiếp bằng Excel để filter.")
+    timing_lines = format_timing_summary(summarize_timing())
+    if timing_lines: body += "\n\nThời gian theo bước:\n" + "\n".join(timing_lines)
     
     msg.attach(MIMEText(body, 'plain', 'utf-8'))
 
     try:
+        started = time.perf_counter()
         server = smtplib.SMTP('smtp.gmail.com', 587)
         server.starttls()
         server.login(EMAIL_USER, EMAIL_PASS)
         server.send_message(msg)
         server.quit()
+        record_phase("smtp.send", time.perf_counter() - started, len(msg.as_bytes()))
         log(">> Đã gửi email báo cáo trạng thái link thành công!")
     except Exception as e:
         log(f"Lỗi gửi email: {e}")
 
+def parse_args(argv):
+    """Dòng lệnh ghi đè nguồn URL: '<file>' / '-' (stdin) / '--playlist <ID>'"""
+    global URL_SOURCE, PLAYLIST_ID
+    if len(argv) >= 2 and argv[0] == '--playlist':
+        PLAYLIST_ID = argv[1]
+    elif argv:
+        URL_SOURCE = argv[0]
+
 def main():
     log("=== KHỞI CHẠY KIỂM TRA TRẠNG THÁI VIDEO HÀNG LOẠT ===")
     start_time = time.time()
-    
-    if not YOUTUBE_URLS:
+    parse_args(sys.argv[1:])
+
+    if PLAYLIST_ID: log(f"Nguồn URL: playlist {PLAYLIST_ID}")
+    elif URL_SOURCE: log(f"Nguồn URL: {'stdin' if URL_SOURCE == '-' else URL_SOURCE}")
+    elif not YOUTUBE_URLS:
         log("Danh sách URL rỗng.")
         return
 
-    check_videos_status(YOUTUBE_URLS)
+    if URL_SOURCE and URL_SOURCE != '-' and not PLAYLIST_ID and not os.path.isfile(URL_SOURCE):
+        log(f"Không tìm thấy file URL: {URL_SOURCE}")
+        return
+
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    with open(CSV_PATH, 'w', newline='', encoding='utf-8-sig') as csv_file:
+        csv.writer(csv_file).writerow(CSV_HEADER)
+        row_count = check_videos_status(iter_input_urls(), csv_file)
     
-    if CSV_DATA:
-        send_email_with_csv(len(YOUTUBE_URLS))
+    if row_count:
+        send_email_with_csv(row_count, CSV_PATH)
     else:
         log("Không có dữ liệu kết quả.")
 
+    log_quota_report()
     elapsed = round(time.time() - start_time, 2)
+    log_timing_report()
+    export_timing_json(os.path.join(REPORT_DIR, "Thoi_gian_kiem_tra_trang_thai_video.json"), elapsed_s=elapsed)
     log(f"=== HOÀN TẤT KIỂM TRA TRONG {elapsed} GIÂY ===")
 
 if __name__ == "__main__":
@@ -0,0 +1,106 @@
+"""
+Benchmark: trích xuất endscreen từ trang xem video.
+
+So sánh cách cũ (tải cả trang + regex lười + json.loads toàn bộ player response), cách parse đủ
+toàn bộ player response (mốc đúng), và extract_endscreen_from_chunks (đọc theo chunk, dừng sớm,
+chỉ giải mã khối endscreen).
+
+Cách chạy:
+    python benchmarks/bench_endscreen_extract.py                      # dùng trang giả lập
+    python benchmarks/bench_endscreen_extract.py --fixtures thu_muc   # dùng các file .html đã lưu
+"""
+import os
+import re
+import sys
+import json
+import glob
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('YOUTUBE_API_KEY', 'benchmark')
+
+import main
+
+
+def build_synthetic_watch_page(filler_kb=300, player_kb=400, tail_kb=700):
+    """Trang giả lập cấu trúc watch page: script đầu trang, player response (endscreen ở cuối), ytInitialData"""
+    formats = [{"itag": i, "url": f"https://rr1.googlevideo.com/videoplayback?id={i}&x=" + "a" * 200,
+                "mimeType": "video/mp4; codecs=\"avc1\"", "note": "chuỗi có ký tự }; { \\\" lạ"} for i in range(player_kb * 1024 // 300)]
+    player = {
+        "responseContext": {"serviceTrackingParams": []},
+        "streamingData": {"adaptiveFormats": formats},
+        "videoDetails": {"videoId": "abcdefghijk", "shortDescription": "Link: https://example.com/};x"},
+        "endscreen": {"endScreenRenderer": {"elements": [
+            {"endScreenElementRenderer": {"endpoint": {"watchEndpoint": {"videoId": f"vid{i:08d}"}}}} for i in range(4)
+        ] + [
+            {"endScreenVideoRenderer": {"videoId": "qbq__igQSR0"}},
+            {"endScreenPlaylistRenderer": {"playlistId": "PLucM008t8hmLdbjkshFtIXGDIJ4LkfAYy"}},
+        ]}},
+    }
+    head = "<html><head><script>" + ("var a=1;" * (filler_kb * 128)) + "</script>"
+    body = f"<script>var ytInitialPlayerResponse = {json.dumps(player)};var meta = document.createElement('meta');</script>"
+    tail = "<script>var ytInitialData = " + json.dumps({"contents": ["x" * 1000] * tail_kb}) + ";</script></html>"
+    return head + body + tail
+
+
+def extract_old(html):
+    match = re.search(r'var ytInitialPlayerResponse\s*=\s*({.+?});', html)
+    if not match: return None
+    try:
+        return json.loads(match.group(1))['endscreen']
+    except (ValueError, KeyError):
+        return None
+
+
+def extract_full_parse(html):
+    """Mốc so sánh công bằng: tải cả trang và json parse toàn bộ player response (đúng, không bị cắt)"""
+    match = re.search(r'ytInitialPlayerResponse\s*=\s*', html)
+    if not match: return None
+    return json.JSONDecoder().raw_decode(html, match.end())[0].get('endscreen')
+
+
+def extract_new(page_bytes, chunk_size):
+    consumed = [0]
+
+    def chunks():
+        for i in range(0, len(page_bytes), chunk_size):
+            consumed[0] += len(page_bytes[i:i + chunk_size])
+            yield page_bytes[i:i + chunk_size].decode('utf-8', errors='replace')
+    return main.extract_endscreen_from_chunks(chunks()), consumed[0]
+
+
+def measure(func, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        result = func()
+    return (time.process_time() - start) / repeat * 1000, result
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fixtures', help="Thư mục chứa các file watch page .html đã lưu")
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    pages = []
+    if args.fixtures:
+        for path in sorted(glob.glob(os.path.join(args.fixtures, '*.html'))):
+            with open(path, 'rb') as f:
+                pages.append((os.path.basename(path), f.read()))
+    if not pages:
+        pages.append(("synthetic", build_synthetic_watch_page().encode('utf-8')))
+
+    for name, page_bytes in pages:
+        old_ms, old_result = measure(lambda: extract_old(page_bytes.decode('utf-8', errors='replace')), args.repeat)
+        full_ms, full_result = measure(lambda: extract_full_parse(page_bytes.decode('utf-8', errors='replace')), args.repeat)
+        new_ms, (new_result, bytes_read) = measure(lambda: extract_new(page_bytes, main.WATCH_PAGE_CHUNK_SIZE), args.repeat)
+        print(f"== {name} ({len(page_bytes)} byte)")
+        print(f"  Cũ     : {old_ms:8.2f} ms CPU, đọc {len(page_bytes)} byte, lấy được endscreen: {old_result is not None}")
+        print(f"  Parse đủ: {full_ms:8.2f} ms CPU, đọc {len(page_bytes)} byte, lấy được endscreen: {full_result is not None}")
+        print(f"  Mới     : {new_ms:8.2f} ms CPU, đọc {bytes_read} byte ({bytes_read * 100 // len(page_bytes)}%), "
+              f"lấy được endscreen: {new_result is not None}")
+
+
+if __name__ == "__main__":
+    main_bench()
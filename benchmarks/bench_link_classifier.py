@@ -0,0 +1,89 @@
+"""
+Benchmark: phân loại link (whitelist / tracking / nội bộ).
+
+So sánh cách cũ (quét tuần tự từng domain/từ khóa bằng `in` trên cả URL) với bộ phân loại mới trong main.py
+(tách host 1 lần + tra set theo từng domain cha, 1 regex dạng cây tiền tố cho từ khóa tracking), trên N URL giả lập
+không trùng nhau (mỗi URL có ID riêng nên không có lợi thế cache).
+In thêm số URL mà 2 cách cho kết quả khác nhau (cách cũ khớp nhầm kiểu '?ref=youtube.com', 'box.com' chứa 'x.com').
+
+Cách chạy:
+    python benchmarks/bench_link_classifier.py                 # 1.000.000 URL
+    python benchmarks/bench_link_classifier.py --count 200000
+    python benchmarks/bench_link_classifier.py --extra-domains 500   # whitelist lớn hơn: cách cũ chậm dần theo số domain
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+OLD_INTERNAL_DOMAINS = ['youtube.com', 'youtu.be', 'google.com']
+
+
+def old_is_whitelist_domain(url):
+    for domain in main.WHITELIST_DOMAINS:
+        if domain in url: return True
+    return False
+
+
+def old_is_tracking_link(url):
+    for kw in main.TRACKING_KEYWORDS:
+        if kw in url: return True
+    return False
+
+
+def old_is_internal_link(url):
+    return any(d in url for d in OLD_INTERNAL_DOMAINS)
+
+
+def build_synthetic_urls(count, seed=1):
+    """URL giả lập giống mô tả video: affiliate, mạng xã hội, link rút gọn, site lạ, có/không query"""
+    rng = random.Random(seed)
+    hosts = ['www.facebook.com', 'm.facebook.com', 't.me', 'zalo.me', 'www.youtube.com', 'youtu.be', 'one.exness-track.com',
+             'my.exness.com', 'ztrade.me', 'bit.ly', 'tinyurl.com', 'go.partner-site.net', 'clicks.trackernet.io',
+             'blog.example.com', 'shop.box.com', 'news.vnexpress.net', 'evilfacebook.com', 'dib.vn', 'icmarkets.com']
+    paths = ['', '/', '/a/b/c', '/intl/vi/register', '/watch', '/p/12345-khuyen-mai', '/s/Ab3dE']
+    queries = ['', '?ref=youtube.com', '?utm_source=youtube&utm_medium=description', '?v=qbq__igQSR0',
+               '?partner=123&track=1', '?id=987654&lang=vi']
+    return [f"https://{rng.choice(hosts)}{rng.choice(paths)}/{i}{rng.choice(queries)}" for i in range(count)]
+
+
+def old_classify_link(url):
+    return old_is_whitelist_domain(url), old_is_tracking_link(url), old_is_internal_link(url)
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=1000000)
+    parser.add_argument('--extra-domains', type=int, default=0, help="Thêm N domain giả vào whitelist")
+    args = parser.parse_args()
+
+    if args.extra_domains:
+        main.WHITELIST_DOMAINS = main.WHITELIST_DOMAINS + [f"partner{i}.example.net" for i in range(args.extra_domains)]
+        main.WHITELIST_HOSTS = frozenset(main.WHITELIST_DOMAINS)
+
+    urls = build_synthetic_urls(args.count)
+    timings = {}
+    # __wrapped__: đo bản thân bộ phân loại, không tính cache LRU (URL giả lập không trùng nhau nên cache luôn miss)
+    for name, classify in [("Cũ", old_classify_link), ("Mới", main.classify_link.__wrapped__)]:
+        start = time.process_time()
+        results = [classify(url) for url in urls]
+        timings[name] = (time.process_time() - start, results)
+
+    print(f"== {args.count} URL giả lập, whitelist {len(main.WHITELIST_DOMAINS)} domain")
+    for name, (seconds, _) in timings.items():
+        print(f"  {name:4}: {seconds:6.2f} giây CPU ({seconds / args.count * 1e6:.2f} µs/URL, 3 phép phân loại)")
+
+    old_results, new_results = timings["Cũ"][1], timings["Mới"][1]
+    for index, label in enumerate(["whitelist", "tracking", "nội bộ"]):
+        diff = [url for url, old, new in zip(urls, old_results, new_results) if old[index] != new[index]]
+        example = f" (vd: {diff[0]})" if diff else ""
+        print(f"  Khác biệt {label}: {len(diff)} URL{example}")
+
+
+if __name__ == "__main__":
+    main_bench()
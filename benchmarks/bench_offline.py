@@ -0,0 +1,159 @@
+"""
+Benchmark offline: chạy code thật của 3 script trên kênh giả lập 100 / 1.000 / 10.000 video, không cần API key hay mạng.
+
+Khởi động benchmarks/fake_services.py (Data API giả, trang xem video giả, pool link 200/404/403/429/chậm/treo/DNS lỗi),
+trỏ script tới đó qua YOUTUBE_API_ROOT và WATCH_PAGE_URL, rồi với mỗi script và mỗi kích thước kênh chạy 1 tiến trình con
+mới (cache link SQLite, ledger quota, thư mục báo cáo đều tạm và trống) để các lượt không dùng lại kết quả của nhau:
+  - main       : pipeline quét kênh của main.py (API + batch comment + trang xem video + check link + ghi CSV)
+  - check_link : check_videos_status của Check_link_rutgon_yt.py trên danh sách URL của kênh (có URL trùng, URL lỗi)
+  - tieude     : iter_all_long_videos của get_tieude_link.py
+In số dòng/giây và p50/p95/p99 từng bước (theo phase_timing) của mỗi lượt.
+
+Pool link dùng nhiều địa chỉ 127.0.x.y để mô phỏng nhiều host: cần Linux (cả dải 127.0.0.0/8 trỏ về loopback).
+
+Cách chạy:
+    python benchmarks/bench_offline.py                                  # main, check_link, tieude với 100 và 1000 video
+    python benchmarks/bench_offline.py --sizes 100,1000,10000 --scripts main
+    python benchmarks/bench_offline.py --api-latency 80 --quota-error-rate 0.02 --json reports/bench_offline.json
+    python benchmarks/bench_offline.py --service-args="--link-hosts 20 --watch-kb 800"
+"""
+import os
+import sys
+import json
+import time
+import shlex
+import tempfile
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCRIPTS = ['main', 'check_link', 'tieude']
+SHOWN_PHASES = ['api.', 'watch_page.', 'link.', 'dns.', 'http.', 'csv.']
+
+
+def configure_env(port, workdir):
+    """Biến môi trường cho tiến trình con, phải đặt trước khi import các script"""
+    os.environ.update({
+        'YOUTUBE_API_KEY': 'benchmark',
+        'YOUTUBE_API_ROOT': f"http://127.0.0.1:{port}/",
+        'WATCH_PAGE_URL': f"http://127.0.0.1:{port + 1}/watch?v={{}}",
+        'LINK_CACHE_DB': os.path.join(workdir, 'link_cache.sqlite3'),
+        'QUOTA_LEDGER': os.path.join(workdir, 'quota_ledger.json'),
+        'REPORT_DIR': os.path.join(workdir, 'reports'),
+        'QUOTA_BACKOFF_BASE': os.environ.get('QUOTA_BACKOFF_BASE', '0.05'),
+        'QUOTA_DAILY_LIMIT': os.environ.get('QUOTA_DAILY_LIMIT', '100000000'),
+    })
+
+
+def run_main(channel_id, size):
+    import main
+    report = main.new_channel_report(channel_id, f"Kênh benchmark {size} video")
+    report["checkpoint"] = False
+    main.open_report_csv(report)
+    try:
+        main.run_channel_pipeline(report, lambda: main.iter_upload_pages(channel_id), set())
+    finally:
+        main.close_report_csv(report)
+        main.shutdown_link_checker()
+        main.close_api_batcher()
+        main.merge_thread_counters()
+    return len(report["processed"]), {key: report["stats"][key] for key in ('videos_scanned', 'links_error', 'endscreen_issues')}
+
+
+def run_check_link(channel_id, size):
+    import Check_link_rutgon_yt as check_link
+    from benchmarks.fake_services import video_id
+    # URL kiểu người dùng dán vào: youtu.be, watch?v= kèm tham số, cứ 10 URL có 1 URL trùng và cứ 50 URL có 1 URL lỗi
+    urls = []
+    for index in range(size):
+        urls.append(f"https://youtu.be/{video_id(index)}" if index % 2 else f"https://www.youtube.com/watch?v={video_id(index)}&t=1")
+        if index % 10 == 9: urls.append(f"https://youtu.be/{video_id(index - 5)}")
+        if index % 50 == 49: urls.append("https://example.com/khong-phai-video")
+    path = os.path.join(os.environ['REPORT_DIR'], 'Check_link.csv')
+    os.makedirs(os.environ['REPORT_DIR'], exist_ok=True)
+    with open(path, 'w', newline='', encoding='utf-8-sig') as csv_file:
+        rows = check_link.check_videos_status(urls, csv_file)
+    return rows, {"urls": len(urls)}
+
+
+def run_tieude(channel_id, size):
+    import get_tieude_link
+    return sum(1 for _ in get_tieude_link.iter_all_long_videos(channel_id)), {}
+
+
+def run_one(script, size, port):
+    """Chạy 1 lượt trong tiến trình con hiện tại, in kết quả JSON ở dòng cuối"""
+    workdir = tempfile.mkdtemp(prefix='bench_offline_')
+    configure_env(port, workdir)
+    from phase_timing import summarize_timing
+    channel_id = f"UCbench{size}"
+    started = time.perf_counter()
+    rows, extra = {'main': run_main, 'check_link': run_check_link, 'tieude': run_tieude}[script](channel_id, size)
+    elapsed = time.perf_counter() - started
+    print(json.dumps({"script": script, "size": size, "rows": rows, "elapsed_s": round(elapsed, 3),
+                      "rows_per_s": round(rows / elapsed, 1) if elapsed else 0, "extra": extra,
+                      "phases": summarize_timing()}, ensure_ascii=False), flush=True)
+
+
+def start_fake_services(port, service_args):
+    command = [sys.executable, os.path.join(ROOT, 'benchmarks', 'fake_services.py'), '--port', str(port)] + service_args
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line.startswith('READY'):
+        process.kill()
+        raise RuntimeError(f"Không khởi động được dịch vụ giả lập: {line!r}")
+    return process
+
+
+def print_result(result):
+    print(f"== {result['script']} | kênh {result['size']} video: {result['rows']} dòng trong {result['elapsed_s']} giây "
+          f"({result['rows_per_s']} dòng/giây) {result['extra'] or ''}")
+    for phase, s in result["phases"].items():
+        if not any(phase.startswith(prefix) for prefix in SHOWN_PHASES): continue
+        print(f"   {phase:22} {s['count']:7} lần  p50 {s['p50_ms']:8.1f}  p95 {s['p95_ms']:8.1f}  p99 {s['p99_ms']:8.1f}  max {s['max_ms']:8.1f} ms")
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='100,1000', help="Số video của các kênh giả lập, cách nhau bởi dấu phẩy")
+    parser.add_argument('--scripts', default=','.join(SCRIPTS), help=f"Các script cần đo: {','.join(SCRIPTS)}")
+    parser.add_argument('--port', type=int, default=18080, help="Cổng Data API giả (trang xem video +1, pool link +2)")
+    parser.add_argument('--api-latency', default='30')
+    parser.add_argument('--quota-error-rate', default='0')
+    parser.add_argument('--service-args', default='', help="Tham số thêm cho fake_services.py")
+    parser.add_argument('--json', default='', help="Ghi toàn bộ kết quả ra file JSON")
+    parser.add_argument('--run-one', nargs=2, metavar=('SCRIPT', 'SIZE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        run_one(args.run_one[0], int(args.run_one[1]), args.port)
+        return
+
+    service_args = ['--api-latency', args.api_latency, '--quota-error-rate', args.quota_error_rate] + shlex.split(args.service_args)
+    services = start_fake_services(args.port, service_args)
+    results = []
+    try:
+        for script in args.scripts.split(','):
+            for size in [int(s) for s in args.sizes.split(',')]:
+                command = [sys.executable, os.path.abspath(__file__), '--port', str(args.port), '--run-one', script, str(size)]
+                output = subprocess.run(command, capture_output=True, text=True, cwd=ROOT)
+                if output.returncode != 0:
+                    print(f"== {script} | kênh {size} video: LỖI\n{output.stderr[-2000:]}")
+                    continue
+                result = json.loads(output.stdout.strip().splitlines()[-1])
+                results.append(result)
+                print_result(result)
+    finally:
+        services.terminate()
+        services.wait()
+
+    if args.json:
+        os.makedirs(os.path.dirname(args.json) or '.', exist_ok=True)
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main_bench()
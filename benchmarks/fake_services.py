@@ -0,0 +1,318 @@
+"""
+Dịch vụ giả lập chạy cục bộ cho benchmark offline (không cần API key, không cần Internet).
+
+3 máy chủ HTTP trên 3 cổng liên tiếp:
+  - PORT     Data API giả: /youtube/v3/{channels,playlistItems,videos,commentThreads,playlists} và /batch
+             (multipart giống Google), có độ trễ, lỗi rateLimitExceeded ngẫu nhiên và giới hạn quota cấu hình được
+  - PORT + 1 Trang xem video giả: /watch?v=ID trả HTML có ytInitialPlayerResponse (kèm khối endscreen),
+             hoặc phát lại các file .html đã lưu (--watch-fixtures)
+  - PORT + 2 Pool link: /status/<mã>, /slow/<ms>, /hang (treo quá timeout), /redirect/<n>/<mã>.
+             Link "DNS lỗi" dùng host *.invalid nên không tới máy chủ này.
+
+Dữ liệu sinh tất định từ ID: kênh "UCbench<N>" có N video "v0000000000".."v<N-1>"; cứ 5 video có 1 Short,
+mô tả và comment chứa link tới pool link (trải trên --link-hosts địa chỉ 127.0.x.y để chính sách theo host
+của main.py hoạt động như với nhiều site thật; Linux trả lời mọi địa chỉ 127.0.0.0/8 nên pool nghe trên 0.0.0.0).
+
+Cách chạy riêng (bench_offline.py tự khởi động script này):
+    python benchmarks/fake_services.py --port 18080 --api-latency 30 --quota-error-rate 0.01
+"""
+import re
+import sys
+import json
+import glob
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+# Tỉ lệ kết quả của pool link (theo link_id % 100): (ngưỡng, loại)
+LINK_MIX = [(70, 'ok'), (78, '404'), (82, '403'), (86, '429'), (94, 'redirect'), (97, 'dns'), (99, 'slow'), (100, 'hang')]
+
+
+def video_id(index):
+    return f"v{index:010d}"
+
+
+def video_index(vid):
+    return int(vid[1:]) if re.fullmatch(r'v\d{10}', vid) else None
+
+
+def link_host(link_id, link_hosts):
+    host = link_id % link_hosts
+    return f"127.0.{host // 250}.{host % 250 + 1}"
+
+
+def link_url(link_id, config):
+    """URL của link thứ link_id trong pool, loại kết quả chọn theo LINK_MIX"""
+    bucket = link_id % 100
+    kind = next(k for limit, k in LINK_MIX if bucket < limit)
+    base = f"http://{link_host(link_id, config.link_hosts)}:{config.port + 2}"
+    if kind == 'ok': return f"{base}/status/200?id={link_id}"
+    if kind in ('404', '403', '429'): return f"{base}/status/{kind}?id={link_id}"
+    if kind == 'redirect': return f"{base}/redirect/2/200?id={link_id}&utm_source=youtube"
+    if kind == 'dns': return f"http://nxdomain-{link_id}.invalid/offer?id={link_id}"
+    if kind == 'slow': return f"{base}/slow/2000?id={link_id}"
+    return f"{base}/hang?id={link_id}"
+
+
+def video_links(index, config, count):
+    return [link_url((index * 7 + k * 13) % config.distinct_links, config) for k in range(count)]
+
+
+class FakeYouTubeData:
+    """Sinh dữ liệu API và trả lời từng lệnh (dùng chung cho gọi thường lẫn từng phần của batch)"""
+    def __init__(self, config):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.units = 0
+        self.calls = 0
+
+    def handle(self, path, params):
+        """Trả về (mã HTTP, dict JSON) cho 1 lệnh GET /youtube/v3/<resource>"""
+        resource = path.rsplit('/', 1)[-1]
+        with self.lock:
+            self.calls += 1
+            self.units += 1
+            over_quota = self.config.quota_limit and self.units > self.config.quota_limit
+            rate_limited = self.rng.random() < self.config.quota_error_rate
+        if over_quota: return error(403, 'quotaExceeded', 'The request cannot be completed because you have exceeded your quota.')
+        if rate_limited: return error(403, 'rateLimitExceeded', 'Rate Limit Exceeded')
+
+        handler = getattr(self, f"list_{resource}", None)
+        if handler is None: return error(404, 'notFound', f'Unknown resource {resource}')
+        return handler({key: values[0] for key, values in params.items()})
+
+    def list_channels(self, params):
+        items = []
+        for channel_id in params.get('id', '').split(','):
+            match = re.fullmatch(r'UCbench(\d+)', channel_id)
+            if not match: continue
+            items.append({
+                "id": channel_id,
+                "snippet": {"title": f"Kênh benchmark {match.group(1)} video"},
+                "contentDetails": {"relatedPlaylists": {"uploads": "UU" + channel_id[2:]}},
+            })
+        return 200, {"items": items}
+
+    def list_playlistItems(self, params):
+        match = re.fullmatch(r'UUbench(\d+)', params.get('playlistId', ''))
+        if not match: return error(404, 'playlistNotFound', 'Playlist not found')
+        total = int(match.group(1))
+        start = int(params.get('pageToken') or 0)
+        end = min(total, start + int(params.get('maxResults', 5)))
+        response = {"items": [{"contentDetails": {"videoId": video_id(i)}} for i in range(start, end)]}
+        if end < total: response["nextPageToken"] = str(end)
+        return 200, response
+
+    def list_videos(self, params):
+        items = []
+        for vid in params.get('id', '').split(','):
+            index = video_index(vid)
+            if index is None or index % 97 == 96: continue  # Video đã xóa / ID sai
+            privacy = 'private' if index % 13 == 12 else 'unlisted' if index % 17 == 16 else 'public'
+            duration = "PT59S" if index % 5 == 4 else f"PT{3 + index % 40}M{index % 60}S"
+            links = "\n".join(video_links(index, self.config, self.config.links_per_video))
+            items.append({
+                "id": vid,
+                "snippet": {
+                    "title": f"Video benchmark số {index}",
+                    "description": f"Mô tả video {index}\nĐăng ký tài khoản tại:\n{links}\nCảm ơn đã xem!",
+                    "publishedAt": f"2024-{index % 12 + 1:02d}-{index % 28 + 1:02d}T{index % 24:02d}:15:00Z",
+                    "tags": ["benchmark", f"tag{index % 10}"],
+                },
+                "contentDetails": {"duration": duration},
+                "statistics": {"viewCount": str(index * 31), "likeCount": str(index % 500),
+                               "commentCount": "0" if index % 7 == 6 else str(3 + index % 20)},
+                "status": {"privacyStatus": privacy},
+            })
+        return 200, {"items": items}
+
+    def list_commentThreads(self, params):
+        index = video_index(params.get('videoId', ''))
+        if index is None: return error(404, 'videoNotFound', 'Video not found')
+        if index % 11 == 10: return error(403, 'commentsDisabled', 'The video has disabled comments.')
+        link = video_links(index + 1, self.config, 1)[0]
+        texts = [f"Video hay quá {index}", f"Link của mình: {link}", "Cảm ơn ad"]
+        return 200, {"items": [{"snippet": {"topLevelComment": {"snippet": {"textDisplay": t, "textOriginal": t}}}}
+                               for t in texts]}
+
+    def list_playlists(self, params):
+        ids = [p for p in params.get('id', '').split(',') if p and not p.endswith('x')]
+        return 200, {"items": [{"id": p, "status": {"privacyStatus": "public"}} for p in ids]}
+
+
+def error(code, reason, message):
+    return code, {"error": {"code": code, "message": message, "errors": [{"reason": reason, "message": message}]}}
+
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # Nhiều luồng check link mở kết nối cùng lúc
+
+    def handle_error(self, request, client_address):
+        # Client đóng kết nối giữa chừng (timeout của script, hết keep-alive) là chuyện bình thường
+        if not isinstance(sys.exc_info()[1], ConnectionError): super().handle_error(request, client_address)
+
+
+class QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Giữ kết nối keep-alive như máy chủ thật
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, code, body, content_type='application/json', extra_headers=None, head=False):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (extra_headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if not head: self.wfile.write(body)
+
+
+def make_api_handler(data, config):
+    class ApiHandler(QuietHandler):
+        def do_GET(self):
+            time.sleep(config.api_latency / 1000)
+            parts = urlsplit(self.path)
+            code, payload = data.handle(parts.path, parse_qs(parts.query))
+            self.send_body(code, json.dumps(payload).encode())
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8', 'replace')
+            if not self.path.startswith('/batch'):
+                self.send_body(404, json.dumps(error(404, 'notFound', 'POST chỉ hỗ trợ /batch')[1]).encode())
+                return
+            time.sleep(config.api_latency / 1000)
+            boundary = re.search(r'boundary="?([^";]+)', self.headers['Content-Type']).group(1)
+            out = []
+            for part in body.split('--' + boundary)[1:-1]:
+                content_id = re.search(r'Content-ID: <(.+?)>', part).group(1)
+                target = urlsplit(re.search(r'GET (\S+)', part).group(1))
+                code, payload = data.handle(target.path, parse_qs(target.query))
+                text = json.dumps(payload)
+                out.append(f"--BENCH\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                           f"HTTP/1.1 {code} X\r\nContent-Type: application/json\r\nContent-Length: {len(text)}\r\n\r\n{text}\r\n")
+            self.send_body(200, ("".join(out) + "--BENCH--").encode(), 'multipart/mixed; boundary=BENCH')
+    return ApiHandler
+
+
+def build_watch_page(index, filler_kb):
+    """Trang xem video giả: script đầu trang, player response (endscreen sau streamingData), ytInitialData"""
+    formats = [{"itag": i, "url": f"https://rr1.googlevideo.com/videoplayback?id={index}&i={i}&x=" + "a" * 200}
+               for i in range(max(1, filler_kb * 1024 // 260))]
+    elements = [{"endScreenVideoRenderer": {"videoId": video_id(index + 1)}},
+                {"endScreenVideoRenderer": {"videoId": video_id(index + 2) if index % 9 else "zzzzzzzzzzz"}},
+                {"endScreenPlaylistRenderer": {"playlistId": f"PLbench{index % 10}" + ("x" if index % 10 == 9 else "")}}]
+    player = {
+        "responseContext": {"serviceTrackingParams": []},
+        "streamingData": {"adaptiveFormats": formats},
+        "videoDetails": {"videoId": video_id(index), "shortDescription": "Link: https://example.com/};x"},
+        "endscreen": {"endScreenRenderer": {"elements": elements}},
+    }
+    head = "<!DOCTYPE html><html><head><script>var ytcfg = {\"x\": \"" + "b" * 20000 + "\"};</script></head><body>"
+    tail = "<script>var ytInitialData = {\"contents\": \"" + "c" * (filler_kb * 512) + "\"};</script></body></html>"
+    return (head + "<script>var ytInitialPlayerResponse = " + json.dumps(player) + ";</script>" + tail).encode()
+
+
+def make_watch_handler(config):
+    fixtures = [open(path, 'rb').read() for path in sorted(glob.glob(f"{config.watch_fixtures}/*.html"))] if config.watch_fixtures else []
+    # Trang giả lập khác nhau ở ID và endscreen, phần lớn dung lượng giống nhau -> dựng sẵn theo index % 100
+    cache = {}
+
+    class WatchHandler(QuietHandler):
+        def do_GET(self):
+            time.sleep(config.watch_latency / 1000)
+            vid = parse_qs(urlsplit(self.path).query).get('v', [''])[0]
+            index = video_index(vid) or 0
+            if fixtures:
+                page = fixtures[index % len(fixtures)]
+            else:
+                page = cache.get(index)
+                if page is None:
+                    page = cache[index] = build_watch_page(index, config.watch_kb)
+                    if len(cache) > 1000: cache.clear()
+            self.send_body(200, page, 'text/html; charset=utf-8')
+    return WatchHandler
+
+
+def make_link_handler(config):
+    class LinkHandler(QuietHandler):
+        def respond(self, head):
+            time.sleep(config.link_latency / 1000)
+            path = urlsplit(self.path).path.strip('/').split('/')
+            if path[0] == 'status':
+                code = int(path[1])
+                headers = {'Retry-After': '30'} if code == 429 else None
+                self.send_body(code, b'<html>status</html>', 'text/html', headers, head)
+            elif path[0] == 'redirect':
+                remaining, final = int(path[1]), path[2]
+                location = f"/redirect/{remaining - 1}/{final}" if remaining > 1 else f"/status/{final}"
+                self.send_body(302, b'', 'text/html', {'Location': location}, head)
+            elif path[0] == 'slow':
+                time.sleep(int(path[1]) / 1000)
+                self.send_body(200, b'<html>slow</html>', 'text/html', None, head)
+            elif path[0] == 'hang':
+                time.sleep(config.hang_seconds)
+                self.send_body(200, b'', 'text/html', None, head)
+            else:
+                self.send_body(404, b'', 'text/html', None, head)
+
+        def do_HEAD(self):
+            self.respond(head=True)
+
+        def do_GET(self):
+            self.respond(head=False)
+    return LinkHandler
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Dịch vụ giả lập cho benchmark offline")
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--api-latency', type=float, default=30, help="ms mỗi request Data API (batch tính 1 lần)")
+    parser.add_argument('--watch-latency', type=float, default=50, help="ms trước khi trả trang xem video")
+    parser.add_argument('--link-latency', type=float, default=20, help="ms mỗi request tới pool link")
+    parser.add_argument('--quota-error-rate', type=float, default=0.0, help="Tỉ lệ lệnh API bị 403 rateLimitExceeded")
+    parser.add_argument('--quota-limit', type=int, default=0, help="Quá số lệnh này thì trả 403 quotaExceeded (0 = không giới hạn)")
+    parser.add_argument('--watch-kb', type=int, default=200, help="Dung lượng xấp xỉ (KB) của trang xem video giả lập")
+    parser.add_argument('--watch-fixtures', default='', help="Thư mục các file .html đã lưu để phát lại thay cho trang giả lập")
+    parser.add_argument('--distinct-links', type=int, default=1000, help="Số link khác nhau dùng chung giữa các video")
+    parser.add_argument('--links-per-video', type=int, default=3)
+    parser.add_argument('--link-hosts', type=int, default=100, help="Số địa chỉ 127.0.x.y khác nhau của pool link")
+    parser.add_argument('--hang-seconds', type=float, default=30, help="Thời gian treo của /hang (lớn hơn timeout của script)")
+    parser.add_argument('--seed', type=int, default=1)
+    return parser
+
+
+def start_services(config):
+    """Khởi động 3 máy chủ trên các luồng nền, trả về danh sách server (gọi shutdown() để dừng)"""
+    data = FakeYouTubeData(config)
+    servers = [
+        QuietServer(('127.0.0.1', config.port), make_api_handler(data, config)),
+        QuietServer(('127.0.0.1', config.port + 1), make_watch_handler(config)),
+        QuietServer(('0.0.0.0', config.port + 2), make_link_handler(config)),
+    ]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return servers, data
+
+
+def main():
+    config = build_parser().parse_args()
+    servers, data = start_services(config)
+    print(f"READY {config.port}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers: server.shutdown()
+        print(f"Data API: {data.calls} lệnh", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
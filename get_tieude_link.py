@@ -1,13 +1,13 @@
 import os
 import re
 import csv
-import io
 import time
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
-from googleapiclient.discovery import build
+from youtube_quota import build_youtube, QuotaExhausted, log_quota_report
+from phase_timing import record_phase, summarize_timing, format_timing_summary, log_timing_report, export_timing_json
 
 # --- CẤU HÌNH ---
 API_KEY = os.environ.get('YOUTUBE_API_KEY')
@@ -16,10 +16,11 @@ EMAIL_USER = os.environ.get('EMAIL_USER')
 EMAIL_PASS = os.environ.get('EMAIL_PASS')
 EMAIL_TO = os.environ.get('EMAIL_TO')
 
-youtube = build('youtube', 'v3', developerKey=API_KEY)
+youtube = build_youtube(API_KEY)
 
 # --- CẤU TRÚC CSV CẬP NHẬT MỚI (ĐÃ BỔ SUNG CỘT MÔ TẢ) ---
-CSV_DATA = []
+# Dòng CSV được ghi thẳng xuống file trong REPORT_DIR theo từng trang API (không giữ cả kênh trong RAM)
+REPORT_DIR = os.environ.get('REPORT_DIR', 'reports')
 CSV_HEADER = [
     'STT', 
     'Tiêu đề Video', 
@@ -70,13 +71,13 @@ def parse_datetime(iso_date_str):
         pass
     return iso_date_str, ""
 
-def get_all_long_videos(channel_id):
-    videos_list = []
+def iter_all_long_videos(channel_id):
+    """Duyệt kênh theo từng trang 50 video, trả về dần từng video dài (> 125 giây)"""
     try:
         ch_response = youtube.channels().list(id=channel_id, part='contentDetails').execute()
         if not ch_response['items']: 
             log("Không tìm thấy thông tin kênh.")
-            return []
+            return
         uploads_playlist_id = ch_response['items'][0]['contentDetails']['relatedPlaylists']['uploads']
         
         next_page_token = None
@@ -119,7 +120,7 @@ def get_all_long_videos(channel_id):
                         # 3. Lấy mô tả video
                         description_str = snippet.get('description', '')
                         
-                        videos_list.append({
+                        yield {
                             'title': snippet['title'],
                             'url': f"https://www.youtube.com/watch?v={item['id']}",
                             'duration': friendly_duration,
@@ -130,29 +131,23 @@ def get_all_long_videos(channel_id):
                             'views': int(stats.get('viewCount', 0)),
                             'likes': int(stats.get('likeCount', 0)),
                             'comments': int(stats.get('commentCount', 0))
-                        })
+                        }
             
             next_page_token = pl_response.get('nextPageToken')
             if not next_page_token: 
                 break
-            
-        return videos_list
     except Exception as e:
         log(f"Lỗi khi lấy dữ liệu: {e}")
-        return []
 
-def send_email_with_csv(channel_name, video_count):
+def send_email_with_csv(channel_name, video_count, csv_path):
     msg = MIMEMultipart()
     msg['From'] = EMAIL_USER
     msg['To'] = EMAIL_TO
     msg['Subject'] = f"[{channel_name}] Báo cáo tối ưu {video_count} video công khai"
 
-    # Lưu dữ liệu với cấu trúc CSV mới
-    csv_buffer = io.StringIO()
-    csv_writer = csv.writer(csv_buffer)
-    csv_writer.writerow(CSV_HEADER)
-    csv_writer.writerows(CSV_DATA)
-    csv_bytes = csv_buffer.getvalue().encode('utf-8-sig')
+    # Đọc file CSV đã ghi dần trong lúc quét
+    with open(csv_path, 'rb') as f:
+        csv_bytes = f.read()
     
     filename = f"Du_lieu_video_toi_uu_{channel_name.replace(' ', '_')}.csv"
     attachment = MIMEApplication(csv_bytes, Name=filename)
@@ -164,15 +159,19 @@ def send_email_with_csv(channel_name, video_count):
             f"- Khung thời gian xuất bản đã được tách biệt hẳn thành 2 cột: 'Ngày đăng' và 'Giờ đăng' để tiện phân tích.\n"
             f"- Đã bổ sung thêm cột 'Mô tả' chi tiết cho từng video.\n\n"
             f"Tổng số lượng video lọc được: {video_count} video.")
+    timing_lines = format_timing_summary(summarize_timing())
+    if timing_lines: body += "\n\nThời gian theo bước:\n" + "\n".join(timing_lines)
     
     msg.attach(MIMEText(body, 'plain', 'utf-8'))
 
     try:
+        started = time.perf_counter()
         server = smtplib.SMTP('smtp.gmail.com', 587)
         server.starttls()
         server.login(EMAIL_USER, EMAIL_PASS)
         server.send_message(msg)
         server.quit()
+        record_phase("smtp.send", time.perf_counter() - started, len(msg.as_bytes()))
         log(">> Đã gửi email báo cáo định dạng mới thành công!")
     except Exception as e:
         log(f"Lỗi gửi email: {e}")
@@ -185,32 +184,45 @@ def main():
     try:
         ch_info = youtube.channels().list(id=CHANNEL_ID, part='snippet').execute()
         channel_name = ch_info['items'][0]['snippet']['title']
+    except QuotaExhausted as e:
+        log(f"Không lấy được tên kênh: {e}")
     except: 
         pass
 
-    videos = get_all_long_videos(CHANNEL_ID)
-    
-    for index, v in enumerate(videos):
-        CSV_DATA.append([
-            index + 1, 
-            v['title'], 
-            v['url'], 
-            v['duration'],
-            v['date'],
-            v['time'],
-            v['description'], # <--- ĐƯA DỮ LIỆU MÔ TẢ VÀO ĐÚNG VỊ TRÍ CỦA HEADER
-            v['tags'],
-            v['views'],
-            v['likes'],
-            v['comments']
-        ])
-
-    if CSV_DATA:
-        send_email_with_csv(channel_name, len(videos))
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    csv_path = os.path.join(REPORT_DIR, f"Du_lieu_video_toi_uu_{CHANNEL_ID}.csv")
+    video_count = 0
+    with open(csv_path, 'w', newline='', encoding='utf-8-sig') as csv_file:
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(CSV_HEADER)
+        for v in iter_all_long_videos(CHANNEL_ID):
+            row_started = time.perf_counter()
+            video_count += 1
+            csv_writer.writerow([
+                video_count, 
+                v['title'], 
+                v['url'], 
+                v['duration'],
+                v['date'],
+                v['time'],
+                v['description'], # <--- ĐƯA DỮ LIỆU MÔ TẢ VÀO ĐÚNG VỊ TRÍ CỦA HEADER
+                v['tags'],
+                v['views'],
+                v['likes'],
+                v['comments']
+            ])
+            csv_file.flush()
+            record_phase("csv.row", time.perf_counter() - row_started)
+
+    if video_count:
+        send_email_with_csv(channel_name, video_count, csv_path)
     else:
         log("Không tìm thấy dữ liệu video phù hợp.")
 
+    log_quota_report()
     elapsed = round(time.time() - start_time, 2)
+    log_timing_report()
+    export_timing_json(os.path.join(REPORT_DIR, f"Thoi_gian_{CHANNEL_ID}.json"), channel_id=CHANNEL_ID, elapsed_s=elapsed)
     log(f"=== HOÀN TẤT TRONG {elapsed} GIÂY ===")
 
 if __name__ == "__main__":
@@ -1,4 +1,5 @@
 import os
+import sys
 import re
 import json
 import requests
@@ -6,39 +7,225 @@ import smtplib
 import time
 import traceback
 import concurrent.futures
+import threading
+import asyncio
+import collections
+import queue
 import csv
-import io
+import sqlite3
+import codecs
+import hashlib
+import fnmatch
+import functools
+import shutil
+import multiprocessing
+import contextvars
+import socket
+import ipaddress
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
-from googleapiclient.discovery import build
+from urllib.parse import urlparse, urlsplit, urlunparse, urlunsplit, urljoin
+from googleapiclient.errors import HttpError
+import youtube_quota
+from youtube_quota import build_youtube, ApiBatcher, QuotaExhausted, quota_blocked, flush_quota_ledger, log_quota_report
+import phase_timing
+from phase_timing import (record_phase, set_timing_scope, get_timing_scope, timing_mark, timing_samples,
+                          merge_timing_samples, summarize_timing, format_timing_summary, log_timing_report, export_timing_json)
 import urllib3
 
 # --- CẤU HÌNH ---
 API_KEY = os.environ.get('YOUTUBE_API_KEY')
 CHANNEL_ID = os.environ.get('CHANNEL_ID')
+# File JSON danh sách kênh để quét nhiều kênh trong 1 tiến trình (bỏ qua nếu có CHANNEL_ID)
+CHANNELS_CONFIG = os.environ.get('CHANNELS_CONFIG')
+CHANNEL_WORKERS = int(os.environ.get('CHANNEL_WORKERS', '5'))
 EMAIL_USER = os.environ.get('EMAIL_USER')
 EMAIL_PASS = os.environ.get('EMAIL_PASS')
 EMAIL_TO = os.environ.get('EMAIL_TO')
 
 # Tắt cảnh báo SSL (Giống logic plugin disable_ssl_verify)
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+# Đo DNS / kết nối mới của requests (check link, trang xem video) cho báo cáo thời gian theo bước,
+# học thời gian kết nối theo host cho timeout thích nghi, phân giải tên miền qua DNS_CACHE
+phase_timing.instrument_urllib3(on_connect=lambda host, seconds: observe_host_latency(normalize_host(host), "connect", seconds),
+                                getaddrinfo=lambda *args, **kwargs: cached_getaddrinfo(*args, **kwargs))
 
-youtube = build('youtube', 'v3', developerKey=API_KEY)
+# Client googleapiclient (httplib2) không an toàn đa luồng -> mỗi luồng giữ 1 client riêng
+_youtube_local = threading.local()
 
 # --- KHAI BÁO BIẾN DỮ LIỆU BÁO CÁO (CSV) ---
-CSV_DATA = []
+# Dòng CSV được ghi thẳng xuống file trong REPORT_DIR ngay khi quét xong từng video (không giữ trong RAM)
+REPORT_DIR = os.environ.get('REPORT_DIR', 'reports')
 CSV_HEADER = ['Video URL', 'Tiêu đề Video', 'Danh Sách Link (Mô Tả)', 'Danh Sách Link (Comment)', 'Trạng Thái EndScreen']
 email_error_lines = []
+# Chỉ giữ tối đa ERROR_LINES_MAX dòng lỗi đầu tiên mỗi kênh cho email/checkpoint (đầy đủ đã có trong CSV, tổng số lỗi trong STATS)
+ERROR_LINES_MAX = int(os.environ.get('ERROR_LINES_MAX', '100'))
 
 STATS = {
     "videos_scanned": 0,
     "total_links_found": 0,
     "links_ok": 0,
     "links_error": 0,
-    "endscreen_issues": 0
+    "endscreen_issues": 0,
+    "videos_failed": 0,
+    "comments_skipped": 0
 }
-LINK_CACHE = {} 
+# Báo cáo của kênh mặc định (chế độ 1 kênh). Chế độ nhiều kênh tạo báo cáo riêng bằng new_channel_report()
+DEFAULT_REPORT = {
+    "channel_id": CHANNEL_ID,
+    "channel_name": "Unknown Channel",
+    "stats": STATS,
+    "csv_path": None,
+    "error_lines": email_error_lines,
+    "processed": []
+}
+
+# Checkpoint tiến độ từng kênh (video đã ghi, STATS, dòng lỗi) để lượt chạy sau với --resume quét tiếp, không làm lại từ đầu
+# (verdict link đã nằm sẵn trong LINK_CACHE_DB, ghi ngay mỗi lần check nên không cần lưu lại trong checkpoint)
+CHECKPOINT_INTERVAL = int(os.environ.get('CHECKPOINT_INTERVAL', '25'))
+CHECKPOINT_MAX_AGE = int(os.environ.get('CHECKPOINT_MAX_AGE', str(2 * 24 * 3600)))
+RESUME = False
+
+# Cache kết quả check link lưu xuống đĩa (SQLite), dùng chung giữa các lượt chạy và các kênh
+LINK_CACHE_DB = os.environ.get('LINK_CACHE_DB', 'link_cache.sqlite3')
+LINK_CACHE_TTL_OK = int(os.environ.get('LINK_CACHE_TTL_OK', str(7 * 24 * 3600)))
+LINK_CACHE_TTL_ERROR = int(os.environ.get('LINK_CACHE_TTL_ERROR', str(6 * 3600)))
+LINK_CACHE_MAX_ENTRIES = int(os.environ.get('LINK_CACHE_MAX_ENTRIES', '50000'))
+LINK_CACHE_STATS = {"hits": 0, "misses": 0}
+_link_cache_db = None
+_link_cache_lock = threading.Lock()
+
+# Chuẩn hóa URL trước khi check: mọi biến thể cùng khóa chuẩn dùng chung 1 lần check và 1 verdict trong cache
+# CANONICAL_DROP_PARAMS: tên tham số query bỏ đi (phân cách bằng dấu phẩy, hỗ trợ *), vd utm_*, fbclid, t=57s
+CANONICAL_DROP_PARAMS = [p.strip() for p in os.environ.get('CANONICAL_DROP_PARAMS', 'utm_*,fbclid,gclid,t,si').split(',') if p.strip()]
+CANONICAL_MERGE_SCHEMES = os.environ.get('CANONICAL_MERGE_SCHEMES', '1') == '1'  # http:// và https:// coi là 1
+CANONICAL_STRIP_TRAILING_SLASH = os.environ.get('CANONICAL_STRIP_TRAILING_SLASH', '1') == '1'
+_CANONICAL_DROP_PARAM = re.compile('|'.join(fnmatch.translate(p.lower()) for p in CANONICAL_DROP_PARAMS) or r'(?!)')
+CANONICAL_VARIANTS = {}  # khóa chuẩn -> các URL gốc đã gặp (URL đầu tiên là URL được check thật)
+
+# Cache từng bước redirect (URL -> URL kế tiếp hoặc mã HTTP cuối), dùng chung giữa các link rút gọn
+REDIRECT_HOP_TTL = int(os.environ.get('REDIRECT_HOP_TTL', str(7 * 24 * 3600)))
+MAX_REDIRECTS = 30  # Giống giới hạn mặc định của requests
+REDIRECT_HOPS = {}
+REDIRECT_STATS = {"hits": 0, "misses": 0}
+
+# Pool check link dùng chung cho cả lượt chạy (thay cho pool 10 luồng tạo mới ở mỗi mô tả/comment)
+LINK_CHECK_WORKERS = int(os.environ.get('LINK_CHECK_WORKERS', '64'))
+LINK_FUTURES = {}
+_link_lock = threading.Lock()
+
+# Giới hạn lịch sự theo từng host: số request đồng thời tối đa + khoảng cách tối thiểu (giây) giữa 2 request
+LINK_HOST_MAX_IN_FLIGHT = int(os.environ.get('LINK_HOST_MAX_IN_FLIGHT', '2'))
+LINK_HOST_MIN_INTERVAL = float(os.environ.get('LINK_HOST_MIN_INTERVAL', '0.5'))
+
+# Timeout thích nghi theo host: connect/read = SRTT + 4*RTTVAR (cách TCP tính RTO) từ độ trễ đo được của host,
+# kẹp trong [LINK_TIMEOUT_MIN, LINK_CONNECT_TIMEOUT / LINK_READ_TIMEOUT]. Host chưa đủ LINK_TIMEOUT_MIN_SAMPLES mẫu dùng mức trần,
+# host đã timeout mà chưa trả lời lần nào trong lượt chạy (tarpit) chỉ được chờ LINK_TIMEOUT_MIN.
+# Lần thăm dò với timeout rút ngắn mà hết giờ thì thử lại 1 lần với mức trần -> verdict giống hệt khi không rút ngắn
+LINK_CONNECT_TIMEOUT = float(os.environ.get('LINK_CONNECT_TIMEOUT', '15'))
+LINK_READ_TIMEOUT = float(os.environ.get('LINK_READ_TIMEOUT', '15'))
+LINK_TIMEOUT_MIN = float(os.environ.get('LINK_TIMEOUT_MIN', '3'))
+LINK_TIMEOUT_MIN_SAMPLES = int(os.environ.get('LINK_TIMEOUT_MIN_SAMPLES', '3'))
+# Ngân sách thời gian (giây) cho phần check link của cả lượt chạy, 0 = không giới hạn.
+# Timeout không vượt quá phần ngân sách còn lại, hết ngân sách thì mọi lần thăm dò chỉ chờ LINK_TIMEOUT_MIN
+LINK_RUN_BUDGET = float(os.environ.get('LINK_RUN_BUDGET', '0'))
+HOST_LATENCY = {}  # host -> {"connect": [srtt, rttvar, số mẫu], "read": [...], "timeouts": n}
+HOST_REACHABLE = set()  # Host đã trả về ít nhất 1 phản hồi HTTP trong lượt chạy
+TIMEOUT_STATS = {"adaptive": 0, "tarpit": 0, "retried": 0, "budget": 0, "timeouts": 0}
+_host_latency_lock = threading.Lock()
+_link_run_started = None
+
+# Cache DNS: mỗi tên miền mới được phân giải trước trên pool riêng ngay khi link được gửi vào hàng đợi (song song với
+# các link đang check), request HTTP dùng lại địa chỉ trong cache. Tên miền không tồn tại -> link DEAD (DNS Error) ngay,
+# không gửi request nào. Lỗi DNS tạm thời (EAI_AGAIN...) không được nhớ.
+DNS_CACHE_TTL = int(os.environ.get('DNS_CACHE_TTL', '300'))
+DNS_NEGATIVE_TTL = int(os.environ.get('DNS_NEGATIVE_TTL', '600'))
+DNS_RESOLVE_WORKERS = int(os.environ.get('DNS_RESOLVE_WORKERS', '32'))
+DNS_CACHE = {}  # tên miền -> (hết hạn theo time.monotonic(), danh sách addrinfo hoặc socket.gaierror)
+DNS_FUTURES = {}  # tên miền đang phân giải -> Future
+DNS_STATS = {"resolved": 0, "failed": 0, "hits": 0, "dead_links": 0}
+_dns_lock = threading.Lock()
+_dns_pool = None
+
+# Các host affiliate xuất hiện hàng nghìn lần -> check nhẹ tay hơn để tránh bị trả 403/429/999
+HOST_POLICY = {
+    'exness.com': (1, 1.0),
+    'one.exness-track.com': (1, 1.0),
+    'ztrade.me': (1, 1.0),
+    'dib.vn': (1, 1.0),
+}
+
+# Chỉ mục video: video nào mô tả + số comment không đổi thì dùng lại comment/end screen đã lưu, không gọi lại API
+VIDEO_INDEX_MAX_AGE = int(os.environ.get('VIDEO_INDEX_MAX_AGE', str(7 * 24 * 3600)))
+VIDEO_INDEX_STATS = {"reused": 0, "audited": 0}
+
+# Đọc trang xem video theo luồng, dừng ngay khi đã lấy xong khối endscreen
+WATCH_PAGE_CHUNK_SIZE = 64 * 1024
+WATCH_PAGE_URL = os.environ.get('WATCH_PAGE_URL', 'https://www.youtube.com/watch?v={}')
+WATCH_PAGE_STATS = {"pages": 0, "bytes_read": 0}
+PLAYER_RESPONSE_MARKER = re.compile(r'ytInitialPlayerResponse\s*=\s*\{')
+_ENDSCREEN_KEY = re.compile(r'"endscreen"\s*:\s*(?=\{)')
+_JSON_DECODER = json.JSONDecoder()
+
+# Memo trạng thái đích của end screen: (loại, ID) -> True (còn sống) / False (bị xóa/ẩn)
+ENDSCREEN_STATUS = {}
+ENDSCREEN_API_STATS = {"targets": 0, "api_calls": 0}
+_endscreen_lock = threading.Lock()
+
+# Batch HTTP cho các lần gọi API độc lập (comment của cả trang video, các nhóm ID end screen), tạo khi dùng lần đầu
+_api_batcher = None
+_api_batcher_lock = threading.Lock()
+
+# Pipeline quét video: pager -> metadata -> comment/trang xem -> check end screen -> chờ link -> ghi CSV
+PIPELINE_QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', '100'))
+PIPELINE_FETCH_WORKERS = int(os.environ.get('PIPELINE_FETCH_WORKERS', '4'))
+PIPELINE_LOG_INTERVAL = int(os.environ.get('PIPELINE_LOG_INTERVAL', '30'))
+PIPELINE_BATCH_WAIT = float(os.environ.get('PIPELINE_BATCH_WAIT', '2'))
+_PIPELINE_DONE = object()
+
+# Chế độ nhiều tiến trình: AUDIT_PROCESSES > 1 thì chia video của kênh thành các shard (tối đa AUDIT_SHARD_SIZE video)
+# chạy trên pool tiến trình riêng (parse JSON/regex/CSV không bị GIL giới hạn 1 core), kết quả gộp lại theo đúng thứ tự.
+# Link vẫn do tiến trình cha check (tiến trình con gửi URL qua hàng đợi) để giới hạn theo host (HOST_POLICY) và
+# single-flight (LINK_FUTURES) áp dụng cho cả lượt chạy. Redirect và chỉ mục video dùng chung qua LINK_CACHE_DB (SQLite WAL)
+AUDIT_PROCESSES = int(os.environ.get('AUDIT_PROCESSES', '1'))
+AUDIT_SHARD_SIZE = int(os.environ.get('AUDIT_SHARD_SIZE', '200'))
+_process_pool = None
+_link_manager = None  # multiprocessing.Manager giữ hàng đợi link giữa tiến trình cha và các shard
+_parent_link_queues = None  # Trong tiến trình con: (số shard, hàng đợi gửi URL về tiến trình cha)
+_process_pool_lock = threading.Lock()
+WORKER_RUN_STATS = {}  # pid tiến trình con -> bộ đếm cộng dồn mới nhất của tiến trình đó
+WORKER_EXTRA_VARIANTS = [0]  # Số biến thể URL các tiến trình con gộp được trước khi gửi link về tiến trình cha
+
+# Engine check link: 'threads' (requests + luồng) hoặc 'async' (aiohttp, 1 luồng event loop)
+LINK_ENGINE = os.environ.get('LINK_ENGINE', 'threads')
+LINK_ASYNC_CONCURRENCY = int(os.environ.get('LINK_ASYNC_CONCURRENCY', '1000'))
+_http_local = threading.local()
+
+# Thăm dò link: HEAD trước, chỉ khi server trả 405/501 mới GET với Range: bytes=0-0
+PROBE_SMALL_BODY = 64 * 1024  # Body nhỏ hơn mức này thì đọc hết để trả kết nối về pool, lớn hơn thì đóng luôn
+PROBE_STATS = {"head": 0, "range_get": 0, "bytes_read": 0, "bytes_skipped": 0, "max_open_fds": 0}
+PROBE_FD_SAMPLE_INTERVAL = float(os.environ.get('PROBE_FD_SAMPLE_INTERVAL', '1'))
+_fd_sampled_at = [float('-inf')]  # Lần đếm fd gần nhất (time.monotonic)
+_async_loop = None
+_async_session = None
+_async_host_state = {}
+
+# Bộ đếm theo luồng: mỗi luồng (fetch, check link) cộng vào dict riêng không cần khóa,
+# merge_thread_counters() gộp phần tăng thêm vào VIDEO_INDEX_STATS / ENDSCREEN_API_STATS / WATCH_PAGE_STATS / PROBE_STATS / TIMEOUT_STATS / DNS_STATS
+_thread_counters = threading.local()
+_all_thread_counters = []
+_merged_thread_counts = {}
+_thread_counters_lock = threading.Lock()
+
+# Trạng thái bộ điều phối theo host (chỉ truy cập khi đang giữ _link_cond)
+_link_cond = threading.Condition(_link_lock)
+_host_queues = {}
+_host_in_flight = {}
+_host_next_time = {}
+_host_round_robin = collections.deque()
+_link_workers = []
+_link_closing = False
 
 # User Agent giả lập trình duyệt thật (Lấy từ PHP Source dòng 288)
 USER_AGENTS = [
@@ -63,6 +250,142 @@ TRACKING_KEYWORDS = [
 def log(message):
     print(message, flush=True)
 
+def count_stat(stats_name, key, amount=1):
+    """Cộng bộ đếm `stats_name`[key] vào bản riêng của luồng hiện tại (khóa max_* thì giữ giá trị lớn nhất)"""
+    counters = getattr(_thread_counters, 'counters', None)
+    if counters is None:
+        counters = _thread_counters.counters = {}
+        with _thread_counters_lock: _all_thread_counters.append(counters)
+    field = (stats_name, key)
+    counters[field] = max(counters.get(field, 0), amount) if key.startswith("max_") else counters.get(field, 0) + amount
+
+def merge_thread_counters():
+    """Gộp phần tăng thêm từ bộ đếm của mọi luồng vào các dict *_STATS toàn cục (luồng chủ vẫn cộng tiếp, không bị xóa)"""
+    with _thread_counters_lock:
+        for counters in _all_thread_counters:
+            for field, value in list(counters.items()):
+                stats_name, key = field
+                target = globals()[stats_name]
+                if key.startswith("max_"):
+                    target[key] = max(target[key], value)
+                else:
+                    merge_key = (id(counters), field)
+                    target[key] += value - _merged_thread_counts.get(merge_key, 0)
+                    _merged_thread_counts[merge_key] = value
+
+def add_error_line(report, line):
+    """Thêm dòng lỗi vào tóm tắt của kênh, bỏ qua khi đã đủ ERROR_LINES_MAX dòng"""
+    if len(report["error_lines"]) < ERROR_LINES_MAX: report["error_lines"].append(line)
+
+def get_youtube():
+    client = getattr(_youtube_local, 'client', None)
+    if client is None:
+        client = build_youtube(API_KEY)
+        _youtube_local.client = client
+    return client
+
+def get_api_batcher():
+    global _api_batcher
+    with _api_batcher_lock:
+        if _api_batcher is None: _api_batcher = ApiBatcher(get_youtube)
+        return _api_batcher
+
+def close_api_batcher():
+    global _api_batcher
+    with _api_batcher_lock:
+        if _api_batcher is not None:
+            _api_batcher.close()
+            _api_batcher = None
+
+def new_channel_report(channel_id, channel_name="Unknown Channel"):
+    return {
+        "channel_id": channel_id,
+        "channel_name": channel_name,
+        "stats": {key: 0 for key in STATS},
+        "csv_path": None,
+        "error_lines": [],
+        "processed": []
+    }
+
+def open_report_csv(report, path=None, header=True):
+    """Tạo file CSV báo cáo của kênh (ghi header ngay), các dòng sau được ghi nối tiếp bằng write_report_row"""
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    report["csv_path"] = path or os.path.join(REPORT_DIR, f"Bao_Cao_{report['channel_id']}.csv")
+    report["csv_file"] = open(report["csv_path"], 'w', newline='', encoding='utf-8-sig')
+    report["csv_writer"] = csv.writer(report["csv_file"])
+    if header: write_report_row(report, CSV_HEADER)
+
+def write_report_row(report, row):
+    report["csv_writer"].writerow(row)
+    # Flush từng dòng để nếu tiến trình chết giữa chừng vẫn còn báo cáo dở dang dùng được
+    report["csv_file"].flush()
+
+def close_report_csv(report):
+    csv_file = report.get("csv_file")
+    if csv_file and not csv_file.closed: csv_file.close()
+
+# --- CHECKPOINT / RESUME ---
+
+def get_checkpoint_path(channel_id):
+    return os.path.join(REPORT_DIR, f"checkpoint_{channel_id}.json")
+
+def save_checkpoint(report):
+    """Ghi tiến độ tới dòng CSV cuối cùng đã ghi xong (ghi ra file tạm rồi đổi tên để không bao giờ để lại checkpoint hỏng)"""
+    if not report.get("csv_file") or report["csv_file"].closed or "row_snapshot" not in report: return
+    report["csv_file"].flush()
+    # Dùng ảnh chụp STATS lúc ghi dòng cuối, không dùng STATS hiện tại (có thể đã cộng dở video đang quét khi bị lỗi)
+    stats, error_count = report["row_snapshot"]
+    checkpoint = {
+        "channel_id": report["channel_id"],
+        "channel_name": report["channel_name"],
+        "processed": report["processed"],
+        "stats": stats,
+        "error_lines": report["error_lines"][:error_count],
+        "csv_size": os.fstat(report["csv_file"].fileno()).st_size,
+        "saved_at": time.time()
+    }
+    path = get_checkpoint_path(report["channel_id"])
+    try:
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        log(f"Lỗi ghi checkpoint: {e}")
+
+def load_checkpoint(report):
+    """Khôi phục tiến độ từ checkpoint (nếu có và còn mới). Trả về True nếu đã khôi phục."""
+    path = get_checkpoint_path(report["channel_id"])
+    csv_path = os.path.join(REPORT_DIR, f"Bao_Cao_{report['channel_id']}.csv")
+    try:
+        with open(path, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if checkpoint.get("channel_id") != report["channel_id"] or not os.path.exists(csv_path): return False
+    if checkpoint["saved_at"] + CHECKPOINT_MAX_AGE <= time.time():
+        log(f"[{report['channel_name']}] Checkpoint quá cũ, quét lại từ đầu")
+        return False
+
+    # Cắt bỏ các dòng ghi sau checkpoint cuối (video chưa được đánh dấu xong) để không bị trùng khi quét tiếp
+    with open(csv_path, 'r+b') as f:
+        f.truncate(checkpoint["csv_size"])
+    report["csv_path"] = csv_path
+    report["csv_file"] = open(csv_path, 'a', newline='', encoding='utf-8')
+    report["csv_writer"] = csv.writer(report["csv_file"])
+    report["processed"] = checkpoint["processed"]
+    # Cập nhật tại chỗ vì DEFAULT_REPORT trỏ vào STATS / email_error_lines toàn cục
+    report["stats"].update(checkpoint["stats"])
+    report["error_lines"][:] = checkpoint["error_lines"]
+    # Video lỗi/hoãn comment chưa nằm trong processed -> lượt này quét lại, không cộng dồn số đếm của lượt trước
+    report["stats"].update(videos_failed=0, comments_skipped=0)
+    return True
+
+def remove_checkpoint(report):
+    try:
+        os.remove(get_checkpoint_path(report["channel_id"]))
+    except FileNotFoundError:
+        pass
+
 def parse_duration(duration_str):
     match = re.match(r'PT(\d+H)?(\d+M)?(\d+S)?', duration_str)
     if not match: return 0
@@ -73,280 +396,1488 @@ def parse_duration(duration_str):
 
 # --- MODULE CHECK LINK (MÔ PHỎNG LOGIC PLUGIN WORDPRESS) ---
 
-def is_whitelist_domain(url):
-    for domain in WHITELIST_DOMAINS:
-        if domain in url: return True
-    return False
+# --- PHÂN LOẠI LINK (WHITELIST / TRACKING / NỘI BỘ) ---
+
+# Phần authority (giữa '//' và '/', '?', '#' đầu tiên) như urlsplit tách netloc
+_URL_AUTHORITY = re.compile(r'(?:[A-Za-z][A-Za-z0-9+.\-]*:)?//([^/?#]*)')
+
+def get_link_host(url):
+    """Host (viết thường, bỏ www.) giống urlsplit(url).hostname mà canonicalize_url dùng, nhưng chỉ 1 regex + cắt chuỗi:
+    bỏ user:pass@ (tính tới @ cuối), port, dấu [] của IPv6"""
+    match = _URL_AUTHORITY.match(url)
+    if not match: return ''
+    host = match.group(1).rpartition('@')[2]
+    if host.startswith('['):
+        end = host.find(']')
+        host = host[1:end] if end != -1 else ''
+    else:
+        host = host.partition(':')[0]
+    return normalize_host(host)
+
+def normalize_host(host):
+    host = host.lower()
+    return host[4:] if host.startswith('www.') else host
 
-def is_tracking_link(url):
-    for kw in TRACKING_KEYWORDS:
-        if kw in url: return True
+def host_in_domains(host, domains):
+    """Host trùng hoặc là subdomain của 1 domain trong set (so theo nhãn: 'evilfacebook.com' không khớp 'facebook.com')"""
+    while host:
+        if host in domains: return True
+        dot = host.find('.')
+        if dot < 0: return False
+        host = host[dot + 1:]
     return False
 
-def check_single_link_detailed(url):
-    # 1. Bỏ qua link nội bộ
-    if any(d in url for d in ['youtube.com', 'youtu.be', 'google.com']): return "INTERNAL", "Nội bộ"
-    if url in LINK_CACHE: return LINK_CACHE[url]
+def build_keyword_pattern(keywords):
+    """Gộp các từ khóa thành 1 regex dạng cây tiền tố: mỗi vị trí trong URL chỉ thử 1 nhánh theo ký tự đầu"""
+    trie = {}
+    for kw in keywords:
+        node = trie
+        for ch in kw: node = node.setdefault(ch, {})
+        node[''] = True
+
+    def to_regex(node):
+        if '' in node: return ''  # Đã khớp trọn 1 từ khóa, không cần đi tiếp (chỉ cần biết có/không)
+        branches = [re.escape(ch) + to_regex(child) for ch, child in sorted(node.items())]
+        return branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    return re.compile(to_regex(trie))
+
+WHITELIST_HOSTS = frozenset(WHITELIST_DOMAINS)
+INTERNAL_HOSTS = frozenset(['youtube.com', 'youtu.be', 'google.com'])
+TRACKING_PATTERN = build_keyword_pattern(TRACKING_KEYWORDS)
+
+@functools.lru_cache(maxsize=65536)
+def classify_link(url):
+    """(whitelist, tracking, nội bộ) của 1 URL, chỉ tách host 1 lần.
+    Có cache: cùng 1 link được hỏi lại ở bước lọc, thăm dò và phân loại kết quả."""
+    host = get_link_host(url)
+    return (host_in_domains(host, WHITELIST_HOSTS), TRACKING_PATTERN.search(url.lower()) is not None,
+            host_in_domains(host, INTERNAL_HOSTS))
+
+def is_trusted_link(url):
+    """Link whitelist hoặc tracking: bị chặn/timeout/từ chối kết nối vẫn coi là OK"""
+    whitelist, tracking, _ = classify_link(url)
+    return whitelist or tracking
+
+def is_internal_link(url):
+    """Link YouTube/Google (theo host, không tính '?ref=youtube.com' ở query)"""
+    return classify_link(url)[2]
+
+# --- CHUẨN HÓA URL ---
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+def canonicalize_url(url):
+    """
+    Khóa chuẩn để gộp các biến thể của cùng 1 link: scheme/host viết thường (http -> https), bỏ port mặc định,
+    bỏ fragment, bỏ dấu / cuối path, bỏ các tham số query trong CANONICAL_DROP_PARAMS (giữ nguyên thứ tự còn lại)
+    """
+    try:
+        parts = urlsplit(url)
+        host = parts.hostname or ''
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    # Chỉ bỏ port mặc định của chính scheme gốc (http://h:443 và https://h:80 là endpoint khác, không gộp)
+    if port == _DEFAULT_PORTS.get(scheme): port = None
+    if CANONICAL_MERGE_SCHEMES and scheme == 'http': scheme = 'https'
+    if ':' in host: host = f"[{host}]"  # IPv6: hostname đã bỏ dấu [], phải thêm lại trước khi ghép port
+    netloc = host if port is None else f"{host}:{port}"
+    if '@' in parts.netloc: netloc = parts.netloc.rsplit('@', 1)[0] + '@' + netloc
+
+    path = parts.path or '/'
+    if CANONICAL_STRIP_TRAILING_SLASH and len(path) > 1: path = path.rstrip('/') or '/'
+    query = '&'.join(
+        param for param in parts.query.split('&')
+        if param and not _CANONICAL_DROP_PARAM.match(param.split('=', 1)[0].lower())
+    )
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+def get_checked_url(url):
+    """URL thực sự được check thay cho url (biến thể gặp đầu tiên của cùng khóa chuẩn)"""
+    variants = CANONICAL_VARIANTS.get(canonicalize_url(url))
+    return variants[0] if variants else url
+
+def log_canonical_stats():
+    variants = sum(len(v) for v in CANONICAL_VARIANTS.values()) + WORKER_EXTRA_VARIANTS[0]
+    keys = len(CANONICAL_VARIANTS)
+    log(f"Chuẩn hóa URL: {variants} biến thể -> {keys} link cần check (tiết kiệm {variants - keys} lượt check)")
+
+# --- CACHE KẾT QUẢ CHECK LINK TRÊN ĐĨA ---
+
+def normalize_cache_key(url):
+    """Khóa cache bước redirect: scheme/host viết thường, bỏ fragment (không gộp http/https vì http -> https thường chính là 1 bước redirect)"""
+    parsed = urlparse(url)
+    return urlunparse((parsed.scheme.lower(), parsed.netloc.lower(), parsed.path, parsed.params, parsed.query, ''))
+
+def _get_link_cache_db():
+    global _link_cache_db
+    if _link_cache_db is None:
+        _link_cache_db = sqlite3.connect(LINK_CACHE_DB, check_same_thread=False, isolation_level=None, timeout=30)
+        # WAL: nhiều tiến trình (AUDIT_PROCESSES) đọc/ghi chung file cache mà không khóa nhau
+        _link_cache_db.execute("PRAGMA journal_mode=WAL")
+        _link_cache_db.execute(
+            "CREATE TABLE IF NOT EXISTS link_verdicts ("
+            "url TEXT PRIMARY KEY, status TEXT, message TEXT, http_code INTEGER, checked_at REAL, ttl INTEGER)"
+        )
+        _link_cache_db.execute(
+            "CREATE TABLE IF NOT EXISTS redirect_hops ("
+            "url TEXT PRIMARY KEY, next_url TEXT, http_code INTEGER, checked_at REAL, ttl INTEGER)"
+        )
+        _link_cache_db.execute(
+            "CREATE TABLE IF NOT EXISTS video_index ("
+            "video_id TEXT PRIMARY KEY, fingerprint TEXT, comments TEXT, endscreen TEXT, audited_at REAL)"
+        )
+    return _link_cache_db
+
+def get_cached_verdict(url):
+    """Trả về (status, message) nếu URL đã có kết quả còn hạn trong cache đĩa, ngược lại None"""
+    with _link_cache_lock:
+        try:
+            row = _get_link_cache_db().execute(
+                "SELECT status, message, checked_at, ttl FROM link_verdicts WHERE url = ?", (canonicalize_url(url),)
+            ).fetchone()
+        except sqlite3.Error as e:
+            log(f"Lỗi đọc cache link: {e}")
+            row = None
+        if row and row[2] + row[3] > time.time():
+            LINK_CACHE_STATS["hits"] += 1
+            return row[0], row[1]
+        LINK_CACHE_STATS["misses"] += 1
+        return None
+
+def store_cached_verdict(url, result, http_code=None):
+    ttl = LINK_CACHE_TTL_OK if result[0] == "OK" else LINK_CACHE_TTL_ERROR
+    with _link_cache_lock:
+        try:
+            _get_link_cache_db().execute(
+                "INSERT OR REPLACE INTO link_verdicts (url, status, message, http_code, checked_at, ttl) VALUES (?, ?, ?, ?, ?, ?)",
+                (canonicalize_url(url), result[0], result[1], http_code, time.time(), ttl)
+            )
+        except sqlite3.Error as e:
+            log(f"Lỗi ghi cache link: {e}")
+
+def get_cached_hop(url, count_stats=True):
+    """Trả về (mã HTTP, URL kế tiếp hoặc None) của 1 bước redirect nếu còn hạn, ngược lại None"""
+    key = normalize_cache_key(url)
+    now = time.time()
+    with _link_cache_lock:
+        hop = REDIRECT_HOPS.get(key)
+        if hop is None:
+            try:
+                row = _get_link_cache_db().execute(
+                    "SELECT next_url, http_code, checked_at + ttl FROM redirect_hops WHERE url = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                log(f"Lỗi đọc cache redirect: {e}")
+                row = None
+            if row:
+                hop = REDIRECT_HOPS[key] = tuple(row)
+        if hop and hop[2] > now:
+            if count_stats: REDIRECT_STATS["hits"] += 1
+            return hop[1], hop[0]
+        if count_stats: REDIRECT_STATS["misses"] += 1
+        return None
+
+def store_cached_hop(url, http_code, next_url):
+    key = normalize_cache_key(url)
+    # Bước redirect thì giữ lâu, trang đích lỗi thì giữ ngắn như verdict lỗi
+    if next_url: ttl = REDIRECT_HOP_TTL
+    elif 200 <= http_code < 400: ttl = LINK_CACHE_TTL_OK
+    else: ttl = LINK_CACHE_TTL_ERROR
+    now = time.time()
+    with _link_cache_lock:
+        REDIRECT_HOPS[key] = (next_url, http_code, now + ttl)
+        try:
+            _get_link_cache_db().execute(
+                "INSERT OR REPLACE INTO redirect_hops (url, next_url, http_code, checked_at, ttl) VALUES (?, ?, ?, ?, ?)",
+                (key, next_url, http_code, now, ttl)
+            )
+        except sqlite3.Error as e:
+            log(f"Lỗi ghi cache redirect: {e}")
+
+def follow_cached_hops(url):
+    """Đi theo chuỗi redirect đã biết (không gọi mạng). Trả về (URL đích, số bước)."""
+    current, hops = url, 0
+    while hops < MAX_REDIRECTS:
+        hop = get_cached_hop(current, count_stats=False)
+        if not hop or not hop[1]: break
+        current, hops = hop[1], hops + 1
+    return current, hops
+
+# --- CHỈ MỤC VIDEO (QUÉT TĂNG DẦN) ---
+
+def get_video_fingerprint(video):
+    """Dấu vân tay nội dung cần audit: mô tả + số comment (comment mới -> số đếm đổi)"""
+    raw = f"{video['desc']}\n{video.get('comment_count')}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def load_video_index(video):
+    """Trả về (comments, endscreen) đã lưu nếu video không đổi và lần audit trước còn mới, ngược lại None"""
+    with _link_cache_lock:
+        try:
+            row = _get_link_cache_db().execute(
+                "SELECT fingerprint, comments, endscreen, audited_at FROM video_index WHERE video_id = ?", (video['id'],)
+            ).fetchone()
+        except sqlite3.Error as e:
+            log(f"Lỗi đọc chỉ mục video: {e}")
+            return None
+    if not row or row[0] != get_video_fingerprint(video) or row[3] + VIDEO_INDEX_MAX_AGE <= time.time():
+        return None
+    return json.loads(row[1]), [tuple(t) for t in json.loads(row[2])]
+
+def save_video_index(video):
+    with _link_cache_lock:
+        try:
+            _get_link_cache_db().execute(
+                "INSERT OR REPLACE INTO video_index (video_id, fingerprint, comments, endscreen, audited_at) VALUES (?, ?, ?, ?, ?)",
+                (video['id'], get_video_fingerprint(video), json.dumps(video['comments']), json.dumps(video['endscreen']), time.time())
+            )
+        except sqlite3.Error as e:
+            log(f"Lỗi ghi chỉ mục video: {e}")
+
+def close_link_cache():
+    """Dọn bản ghi hết hạn, giới hạn kích thước cache (bỏ bản ghi cũ nhất), in thống kê hit/miss"""
+    global _link_cache_db
+    with _link_cache_lock:
+        # Ở chế độ shard tiến trình cha không tra cache nhưng vẫn là nơi dọn cache cuối lượt
+        if _link_cache_db is None and AUDIT_PROCESSES > 1: _get_link_cache_db()
+        if _link_cache_db is not None:
+            try:
+                _link_cache_db.execute("DELETE FROM link_verdicts WHERE checked_at + ttl <= ?", (time.time(),))
+                _link_cache_db.execute(
+                    "DELETE FROM link_verdicts WHERE url NOT IN "
+                    "(SELECT url FROM link_verdicts ORDER BY checked_at DESC LIMIT ?)", (LINK_CACHE_MAX_ENTRIES,)
+                )
+                _link_cache_db.execute("DELETE FROM video_index WHERE audited_at + ? <= ?", (VIDEO_INDEX_MAX_AGE, time.time()))
+                _link_cache_db.execute("DELETE FROM redirect_hops WHERE checked_at + ttl <= ?", (time.time(),))
+                _link_cache_db.execute(
+                    "DELETE FROM redirect_hops WHERE url NOT IN "
+                    "(SELECT url FROM redirect_hops ORDER BY checked_at DESC LIMIT ?)", (LINK_CACHE_MAX_ENTRIES,)
+                )
+                # Dồn WAL vào file chính và cắt về 0 byte: file .sqlite3 tự đủ dữ liệu khi được lưu/chép riêng
+                _link_cache_db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.Error as e:
+                log(f"Lỗi dọn cache link: {e}")
+            _link_cache_db.close()
+            _link_cache_db = None
+
+    total = LINK_CACHE_STATS["hits"] + LINK_CACHE_STATS["misses"]
+    log(f"Cache link: {LINK_CACHE_STATS['hits']} hit / {LINK_CACHE_STATS['misses']} miss (tổng {total} lượt tra)")
+    log(f"Cache redirect: {REDIRECT_STATS['hits']} bước lấy từ cache / {REDIRECT_STATS['misses']} bước gọi mạng")
 
+def build_link_headers():
     import random
-    headers = {
+    return {
         'User-Agent': random.choice(USER_AGENTS),
         'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
         'Connection': 'keep-alive',
         'Upgrade-Insecure-Requests': '1',
         'Referer': 'https://www.google.com/'
     }
-    
-    result = ("OK", "200 OK") 
-    
-    try:
-        # Timeout 15s (Plugin PHP dùng 20s, ta dùng 15s cho nhanh hơn chút)
-        response = requests.get(url, headers=headers, timeout=15, verify=False, stream=True, allow_redirects=True)
-        code = response.status_code
-        
-        # --- LOGIC MÔ PHỎNG PLUGIN ---
+
+# --- LOGIC MÔ PHỎNG PLUGIN (dùng chung cho cả engine threads và async) ---
+
+def classify_status_code(url, code):
+    # Trường hợp 1: Mã phản hồi Tốt (200-399) [PHP Source: 310]
+    if 200 <= code < 400: 
+        return ("OK", f"OK ({code})")
         
-        # Trường hợp 1: Mã phản hồi Tốt (200-399) [PHP Source: 310]
-        if 200 <= code < 400: 
-            result = ("OK", f"OK ({code})")
-            
-        # Trường hợp 2: Lỗi 404/410 -> CHẾT THẬT [PHP Source: 309]
-        elif code in [404, 410]:
-            result = ("ERROR", f"DEAD ({code} Not Found)")
-            
-        # Trường hợp 3: Các mã lỗi chặn Bot (403, 429, 503...) [PHP Source: 311]
-        elif code in [400, 403, 406, 429, 503, 999, 401]:
-            if is_whitelist_domain(url) or is_tracking_link(url): 
-                result = ("OK", f"OK (Anti-Bot {code})")
-            else: 
-                result = ("ERROR", f"DEAD ({code} - Blocked)")
+    # Trường hợp 2: Lỗi 404/410 -> CHẾT THẬT [PHP Source: 309]
+    elif code in [404, 410]:
+        return ("ERROR", f"DEAD ({code} Not Found)")
         
+    # Trường hợp 3: Các mã lỗi chặn Bot (403, 429, 503...) [PHP Source: 311]
+    elif code in [400, 403, 406, 429, 503, 999, 401]:
+        if is_trusted_link(url):
+            return ("OK", f"OK (Anti-Bot {code})")
         else: 
-            result = ("ERROR", f"WARNING ({code})")
+            return ("ERROR", f"DEAD ({code} - Blocked)")
+    
+    return ("ERROR", f"WARNING ({code})")
+
+# --- XỬ LÝ EXCEPTIONS (MÔ PHỎNG ERRNO CỦA CURL) ---
+
+def is_dns_error(error):
+    """Lỗi không phân giải được tên miền (tên miền chết), khác lỗi DNS tạm thời"""
+    error_msg = str(error).lower()
+    return "name or service not known" in error_msg or "resolution failed" in error_msg
+
+def classify_timeout(url):
+    # [MÔ PHỎNG PHP Source: 308] Errno 28 (Timeout) -> Coi là Alive
+    # Lý do: Link chết thường báo lỗi DNS ngay, còn Timeout là do server chặn hoặc lag.
+    if is_trusted_link(url):
+         return ("OK", "OK (Timeout/Slow)")
+    # Nếu không phải link quan trọng thì timeout coi như lỗi
+    return ("ERROR", "Timeout")
+
+def classify_connection_error(url, error):
+    # [MÔ PHỎNG PHP Source: 307] Errno 6 (DNS Error) -> DEAD
+    # Nếu không phân giải được tên miền -> Chết thật (ztrade.me mất domain)
+    if is_dns_error(error):
+        return ("ERROR", "DEAD (DNS Error)")
+        
+    # [MÔ PHỎNG PHP Source: 314] Code 0 + Tracking -> Alive
+    # Nếu lỗi kết nối KHÁC (như Connection Refused do chặn IP) VÀ là Tracking Link -> OK
+    elif is_trusted_link(url):
+        return ("OK", "OK (Protected/Refused)")
+    return ("ERROR", "Connection Failed")
+
+def get_cached_link_result(url):
+    """Tra kết quả trong cache đĩa. Link nội bộ trả về luôn.
+    Trong 1 lượt chạy mỗi khóa chuẩn chỉ tới đây 1 lần: submit_link_check giữ Future dùng chung (LINK_FUTURES)."""
+    # 1. Bỏ qua link nội bộ
+    if is_internal_link(url): return "INTERNAL", "Nội bộ"
+    return get_cached_verdict(url)
+
+def get_http_session():
+    """Mỗi luồng giữ 1 Session riêng để tái sử dụng kết nối keep-alive/TLS giữa các lần check"""
+    session = getattr(_http_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        _http_local.session = session
+    return session
+
+# --- CACHE DNS / PHÂN GIẢI TRƯỚC ---
+
+def get_url_hostname(url):
+    """Tên miền thật để phân giải (giữ www., khác get_link_host dùng để gom host)"""
+    try:
+        return urlsplit(url).hostname or ''
+    except ValueError:
+        return ''
+
+def is_ip_literal(host):
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+def _resolve_hostname(hostname):
+    """Phân giải thật (chạy trên pool DNS), trả về danh sách addrinfo hoặc socket.gaierror và ghi vào DNS_CACHE"""
+    started = time.perf_counter()
+    try:
+        result = socket.getaddrinfo(hostname, 0, 0, socket.SOCK_STREAM)
+        ttl = DNS_CACHE_TTL
+        count_stat("DNS_STATS", "resolved")
+    except socket.gaierror as e:
+        result = e
+        ttl = DNS_NEGATIVE_TTL if is_dns_error(e) else 0
+        count_stat("DNS_STATS", "failed")
+    record_phase("dns.resolve", time.perf_counter() - started)
+
+    with _dns_lock:
+        if ttl: DNS_CACHE[hostname] = (time.monotonic() + ttl, result)
+        DNS_FUTURES.pop(hostname, None)
+    if isinstance(result, socket.gaierror) and is_dns_error(result): _fail_queued_links(hostname, result)
+    return result
+
+def prefetch_hostname(hostname):
+    """Future kết quả phân giải tên miền: lấy từ cache, hoặc chờ chung lần phân giải đang chạy, hoặc gửi lên pool DNS"""
+    global _dns_pool
+    with _dns_lock:
+        cached = DNS_CACHE.get(hostname)
+        if cached and cached[0] > time.monotonic():
+            count_stat("DNS_STATS", "hits")
+            future = concurrent.futures.Future()
+            future.set_result(cached[1])
+            return future
+        future = DNS_FUTURES.get(hostname)
+        if future is None:
+            if _dns_pool is None:
+                _dns_pool = concurrent.futures.ThreadPoolExecutor(max_workers=DNS_RESOLVE_WORKERS, thread_name_prefix='dns')
+            future = DNS_FUTURES[hostname] = _dns_pool.submit(_resolve_hostname, hostname)
+        return future
+
+def get_dns_error(url):
+    """socket.gaierror nếu tên miền của url không tồn tại (chờ kết quả phân giải trước), None nếu phân giải được"""
+    hostname = get_url_hostname(url)
+    if not hostname or is_ip_literal(hostname): return None
+    result = prefetch_hostname(hostname).result()
+    return result if isinstance(result, socket.gaierror) and is_dns_error(result) else None
+
+def cached_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+    """Thay socket.getaddrinfo cho urllib3: địa chỉ lấy từ DNS_CACHE (thường đã phân giải trước), thiếu thì phân giải 1 lần"""
+    if proto or flags or type not in (0, socket.SOCK_STREAM) or not isinstance(host, str) or is_ip_literal(host):
+        return socket.getaddrinfo(host, port, family, type, proto, flags)
+    result = prefetch_hostname(host.lower()).result()
+    if isinstance(result, socket.gaierror):
+        # Tạo exception mới mỗi lần: raise lại cùng 1 đối tượng từ nhiều luồng sẽ nối dài traceback của nó
+        raise socket.gaierror(result.errno, result.strerror)
+    port = int(port or 0)
+    addresses = [(fam, socktype, proto, canonname, (sockaddr[0], port) + tuple(sockaddr[2:]))
+                 for fam, socktype, proto, canonname, sockaddr in result if not family or fam == family]
+    return addresses or socket.getaddrinfo(host, port, family, type, proto, flags)
+
+def build_async_resolver():
+    """Resolver của engine async (aiohttp) dùng chung DNS_CACHE với engine threads"""
+    from aiohttp.abc import AbstractResolver
+
+    class CachedResolver(AbstractResolver):
+        async def resolve(self, host, port=0, family=socket.AF_INET):
+            result = await asyncio.wrap_future(prefetch_hostname(host.lower()))
+            if isinstance(result, socket.gaierror): raise socket.gaierror(result.errno, result.strerror)
+            return [{"hostname": host, "host": sockaddr[0], "port": port, "family": fam, "proto": proto,
+                     "flags": socket.AI_NUMERICHOST | socket.AI_NUMERICSERV}
+                    for fam, _, proto, _, sockaddr in result if not family or fam == family]
+
+        async def close(self):
+            pass
+
+    return CachedResolver()
+
+def dns_dead_verdict(url, error):
+    """Verdict cho link có tên miền không tồn tại, không gửi request HTTP nào"""
+    count_stat("DNS_STATS", "dead_links")
+    result = classify_connection_error(url, error)
+    store_cached_verdict(url, result)
+    return result
+
+def _fail_queued_links(hostname, error):
+    """Tên miền vừa được xác định không tồn tại -> các link của nó đang chờ trong hàng đợi host trả DEAD luôn, không chờ tới lượt"""
+    failed = []
+    with _link_cond:
+        host = normalize_host(hostname)
+        jobs = _host_queues.get(host)
+        if not jobs: return
+        keep = collections.deque(job for job in jobs if get_url_hostname(job[0]) != hostname)
+        failed = [job for job in jobs if get_url_hostname(job[0]) == hostname]
+        if keep:
+            _host_queues[host] = keep
+        else:
+            del _host_queues[host]
+            _host_round_robin.remove(host)
+    for url, future, scope in failed:
+        if not future.set_running_or_notify_cancel(): continue
+        try:
+            future.set_result(get_cached_link_result(url) or dns_dead_verdict(url, error))
+        except Exception as e:
+            future.set_exception(e)
+
+def log_dns_stats():
+    log(f"DNS: {DNS_STATS['resolved']} tên miền phân giải được, {DNS_STATS['failed']} lỗi, {DNS_STATS['hits']} lượt dùng cache, "
+        f"{DNS_STATS['dead_links']} link DEAD (DNS Error) không cần gửi request")
+
+# --- TIMEOUT THÍCH NGHI THEO HOST ---
+
+def _new_host_latency():
+    return {"connect": [0.0, 0.0, 0], "read": [0.0, 0.0, 0], "timeouts": 0}
 
-    # --- XỬ LÝ EXCEPTIONS (MÔ PHỎNG ERRNO CỦA CURL) ---
+def observe_host_latency(host, kind, seconds):
+    """Cập nhật ước lượng độ trễ `kind` ('connect' / 'read' = tới byte đầu) của host theo SRTT/RTTVAR"""
+    with _host_latency_lock:
+        estimate = HOST_LATENCY.setdefault(host, _new_host_latency())[kind]
+        srtt, rttvar, samples = estimate
+        if samples == 0:
+            estimate[:] = [seconds, seconds / 2, 1]
+        else:
+            estimate[:] = [0.875 * srtt + 0.125 * seconds, 0.75 * rttvar + 0.25 * abs(srtt - seconds), samples + 1]
+        if kind == "read": HOST_REACHABLE.add(host)
+
+def observe_host_timeout(host):
+    count_stat("TIMEOUT_STATS", "timeouts")
+    with _host_latency_lock:
+        HOST_LATENCY.setdefault(host, _new_host_latency())["timeouts"] += 1
+
+def _learned_timeout(estimate, ceiling):
+    srtt, rttvar, samples = estimate
+    if samples < LINK_TIMEOUT_MIN_SAMPLES: return ceiling
+    return min(ceiling, max(LINK_TIMEOUT_MIN, srtt + 4 * rttvar))
+
+def get_link_timeouts(url):
+    """(connect, read) timeout cho lần thăm dò đầu tiên của url (học theo host, rút ngắn với host tarpit)"""
+    host = get_link_host(url)
+    with _host_latency_lock:
+        state = HOST_LATENCY.get(host)
+        reachable = host in HOST_REACHABLE
+
+    connect, read = LINK_CONNECT_TIMEOUT, LINK_READ_TIMEOUT
+    if state and state["timeouts"] and not reachable:
+        connect = read = LINK_TIMEOUT_MIN
+        count_stat("TIMEOUT_STATS", "tarpit")
+    elif state:
+        connect = _learned_timeout(state["connect"], connect)
+        read = _learned_timeout(state["read"], read)
+        if (connect, read) != (LINK_CONNECT_TIMEOUT, LINK_READ_TIMEOUT): count_stat("TIMEOUT_STATS", "adaptive")
+    return apply_run_budget(connect, read)
+
+def get_ceiling_timeouts():
+    """Mức trần (connect, read) cho lần thử lại quyết định verdict"""
+    return apply_run_budget(LINK_CONNECT_TIMEOUT, LINK_READ_TIMEOUT)
+
+def apply_run_budget(connect, read):
+    """Kẹp timeout theo phần còn lại của LINK_RUN_BUDGET (nếu có đặt)"""
+    global _link_run_started
+    if not LINK_RUN_BUDGET: return connect, read
+    with _host_latency_lock:
+        if _link_run_started is None: _link_run_started = time.monotonic()
+        remaining = LINK_RUN_BUDGET - (time.monotonic() - _link_run_started)
+    if max(connect, read) > remaining:
+        limit = max(remaining, LINK_TIMEOUT_MIN)
+        connect, read = min(connect, limit), min(read, limit)
+        count_stat("TIMEOUT_STATS", "budget")
+    return connect, read
+
+def log_timeout_stats():
+    log(f"Timeout link: {TIMEOUT_STATS['timeouts']} lần hết giờ; {TIMEOUT_STATS['adaptive']} lần dùng timeout học theo host, "
+        f"{TIMEOUT_STATS['tarpit']} lần rút ngắn cho host không trả lời, {TIMEOUT_STATS['retried']} lần thử lại với mức trần, "
+        f"{TIMEOUT_STATS['budget']} lần bị giới hạn bởi ngân sách lượt chạy")
+
+# --- THĂM DÒ LINK (HEAD / RANGE GET) ---
+
+def sample_open_fds():
+    """Đếm fd đang mở tối đa 1 lần mỗi PROBE_FD_SAMPLE_INTERVAL giây (os.listdir mỗi lượt thăm dò quá tốn)"""
+    now = time.monotonic()
+    if now - _fd_sampled_at[0] < PROBE_FD_SAMPLE_INTERVAL: return
+    _fd_sampled_at[0] = now
+    count_stat("PROBE_STATS", "max_open_fds", count_open_fds())
+
+def count_open_fds():
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return 0
+
+def get_declared_page_size(headers):
+    """Kích thước trang theo header (ưu tiên tổng trong Content-Range của phản hồi 206)"""
+    content_range = headers.get('Content-Range', '')
+    if '/' in content_range and content_range.rsplit('/', 1)[1].isdigit():
+        return int(content_range.rsplit('/', 1)[1])
+    content_length = headers.get('Content-Length', '')
+    return int(content_length) if content_length.isdigit() else 0
+
+def record_probe(method, bytes_read, page_size):
+    count_stat("PROBE_STATS", method)
+    count_stat("PROBE_STATS", "bytes_read", bytes_read)
+    count_stat("PROBE_STATS", "bytes_skipped", max(page_size - bytes_read, 0))
+    sample_open_fds()
+
+def log_probe_stats():
+    total = PROBE_STATS["head"] + PROBE_STATS["range_get"]
+    if not total: return
+    log(f"Thăm dò link: {total} lượt ({PROBE_STATS['head']} HEAD, {PROBE_STATS['range_get']} Range GET), "
+        f"đọc {PROBE_STATS['bytes_read']} byte (TB {PROBE_STATS['bytes_read'] // total} byte/link), "
+        f"bỏ qua {PROBE_STATS['bytes_skipped']} byte body, tối đa {PROBE_STATS['max_open_fds']} fd mở")
+
+def get_redirect_target(url, response_status, response_headers):
+    location = response_headers.get('Location')
+    if response_status in (301, 302, 303, 307, 308) and location:
+        return urljoin(url, location)
+    return None
+
+def probe_single_hop(url, headers):
+    """Thăm dò 1 bước (không tự follow redirect). Trả về (mã HTTP, URL kế tiếp hoặc None).
+    Hết giờ với timeout rút ngắn thì thử lại 1 lần với mức trần trước khi báo Timeout."""
+    timeouts = get_link_timeouts(url)
+    try:
+        return _probe_single_hop(url, headers, timeouts)
+    except requests.exceptions.Timeout:
+        observe_host_timeout(get_link_host(url))
+        ceiling = get_ceiling_timeouts()
+        if timeouts == ceiling: raise
+        count_stat("TIMEOUT_STATS", "retried")
+    try:
+        return _probe_single_hop(url, headers, ceiling)
+    except requests.exceptions.Timeout:
+        observe_host_timeout(get_link_host(url))
+        raise
+
+def _probe_single_hop(url, headers, timeout):
+    session = get_http_session()
+    # timeout = (connect, read): tối đa LINK_CONNECT_TIMEOUT / LINK_READ_TIMEOUT (15s, plugin PHP dùng 20s), ngắn hơn với host đã học
+    response = session.head(url, headers=headers, timeout=timeout, verify=False, allow_redirects=False)
+    response.close()
+    record_phase("link.ttfb", response.elapsed.total_seconds())
+    observe_host_latency(get_link_host(url), "read", response.elapsed.total_seconds())
+    if response.status_code not in (405, 501):
+        record_probe("head", 0, get_declared_page_size(response.headers))
+        return response.status_code, get_redirect_target(url, response.status_code, response.headers)
+
+    # Server không hỗ trợ HEAD -> GET chỉ xin 1 byte đầu
+    range_headers = dict(headers, Range='bytes=0-0')
+    response = session.get(url, headers=range_headers, timeout=timeout, verify=False, stream=True, allow_redirects=False)
+    record_phase("link.ttfb", response.elapsed.total_seconds())
+    observe_host_latency(get_link_host(url), "read", response.elapsed.total_seconds())
+    bytes_read = 0
+    try:
+        page_size = get_declared_page_size(response.headers)
+        if response.status_code == 206 or page_size <= PROBE_SMALL_BODY:
+            for chunk in response.iter_content(8192):
+                bytes_read += len(chunk)
+                if bytes_read > PROBE_SMALL_BODY: break
+    finally:
+        response.close()
+    record_probe("range_get", bytes_read, page_size)
+    return response.status_code, get_redirect_target(url, response.status_code, response.headers)
+
+def probe_link_status(url, headers):
+    """Tự đi theo chuỗi redirect, bước nào đã có trong cache thì không gọi mạng. Trả về mã HTTP cuối."""
+    current, hops = url, 0
+    while True:
+        hop = get_cached_hop(current)
+        if hop is None:
+            hop = probe_single_hop(current, headers)
+            store_cached_hop(current, *hop)
+        code, next_url = hop
+        if not next_url: return code
+        hops += 1
+        if hops > MAX_REDIRECTS:
+            raise requests.exceptions.TooManyRedirects(f"Exceeded {MAX_REDIRECTS} redirects.")
+        current = next_url
+
+def check_single_link_detailed(url):
+    cached = get_cached_link_result(url)
+    if cached: return cached
+    dns_error = get_dns_error(url)
+    if dns_error: return dns_dead_verdict(url, dns_error)
+
+    headers = build_link_headers()
+    result = ("OK", "200 OK") 
+    code = None
     
+    started = time.perf_counter()
+    try:
+        code = probe_link_status(url, headers)
+        result = classify_status_code(url, code)
+
     except requests.exceptions.Timeout:
-        # [MÔ PHỎNG PHP Source: 308] Errno 28 (Timeout) -> Coi là Alive
-        # Lý do: Link chết thường báo lỗi DNS ngay, còn Timeout là do server chặn hoặc lag.
-        if is_whitelist_domain(url) or is_tracking_link(url):
-             result = ("OK", "OK (Timeout/Slow)")
-        else:
-             # Nếu không phải link quan trọng thì timeout coi như lỗi
-             result = ("ERROR", "Timeout")
+        result = classify_timeout(url)
 
     except requests.exceptions.ConnectionError as e:
-        error_msg = str(e).lower()
-        
-        # [MÔ PHỎNG PHP Source: 307] Errno 6 (DNS Error) -> DEAD
-        # Nếu không phân giải được tên miền -> Chết thật (ztrade.me mất domain)
-        if "name or service not known" in error_msg or "resolution failed" in error_msg:
-            result = ("ERROR", "DEAD (DNS Error)")
-            
-        # [MÔ PHỎNG PHP Source: 314] Code 0 + Tracking -> Alive
-        # Nếu lỗi kết nối KHÁC (như Connection Refused do chặn IP) VÀ là Tracking Link -> OK
-        elif is_whitelist_domain(url) or is_tracking_link(url):
-            result = ("OK", "OK (Protected/Refused)")
-        else:
-            result = ("ERROR", "Connection Failed")
+        result = classify_connection_error(url, e)
 
     except requests.exceptions.RequestException as e:
         result = ("ERROR", f"Error ({str(e)})")
 
-    LINK_CACHE[url] = result
+    record_phase("link.probe", time.perf_counter() - started)
+    store_cached_verdict(url, result, code)
     return result
 
-def audit_text_links_return_list(text, source_type):
+# --- ENGINE ASYNC (aiohttp): 1 luồng event loop, pool kết nối keep-alive theo host ---
+
+def _start_async_engine():
+    global _async_loop
+    if _async_loop is None:
+        _async_loop = asyncio.new_event_loop()
+        threading.Thread(target=_async_loop.run_forever, daemon=True).start()
+    return _async_loop
+
+async def _get_async_session():
+    global _async_session
+    if _async_session is None:
+        import aiohttp
+        # Tên miền phân giải qua DNS_CACHE (dùng chung với engine threads và bước phân giải trước) thay cho cache của aiohttp
+        connector = aiohttp.TCPConnector(limit=LINK_ASYNC_CONCURRENCY, ssl=False, use_dns_cache=False, resolver=build_async_resolver())
+        # Timeout theo từng request (get_link_timeouts), mặc định của session chỉ là mức trần
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=LINK_CONNECT_TIMEOUT, sock_read=LINK_READ_TIMEOUT)
+        _async_session = aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=[build_async_trace_config()])
+    return _async_session
+
+def build_async_trace_config():
+    """Đo DNS, kết nối mới và TTFB của engine async (cùng tên bước với engine threads)"""
+    import aiohttp
+    trace = aiohttp.TraceConfig()
+
+    def start(name):
+        async def handler(session, ctx, params):
+            setattr(ctx, name, time.perf_counter())
+        return handler
+
+    def end(name, phase, latency_kind=None):
+        async def handler(session, ctx, params):
+            started = getattr(ctx, name, None)
+            if started is None: return
+            seconds = time.perf_counter() - started
+            record_phase(phase, seconds)
+            # Host lấy từ on_request_start (chạy trước khi tạo kết nối) -> học độ trễ theo host như engine threads
+            if latency_kind and getattr(ctx, 'host', None): observe_host_latency(ctx.host, latency_kind, seconds)
+        return handler
+
+    async def request_start(session, ctx, params):
+        ctx.request_started = time.perf_counter()
+        ctx.host = get_link_host(str(params.url))
+
+    trace.on_dns_resolvehost_start.append(start('dns_started'))
+    trace.on_dns_resolvehost_end.append(end('dns_started', "http.dns"))
+    trace.on_connection_create_start.append(start('connect_started'))
+    trace.on_connection_create_end.append(end('connect_started', "http.connect", "connect"))
+    # on_request_end chạy khi đã nhận xong header phản hồi -> thời gian tới byte đầu tiên
+    trace.on_request_start.append(request_start)
+    trace.on_request_end.append(end('request_started', "link.ttfb", "read"))
+    return trace
+
+async def _acquire_async_host_slot(host):
+    """Áp dụng cùng chính sách lịch sự theo host (HOST_POLICY) cho engine async"""
+    max_in_flight, min_interval = get_host_policy(host)
+    state = _async_host_state.get(host)
+    if state is None:
+        state = {'sem': asyncio.Semaphore(max_in_flight), 'lock': asyncio.Lock(), 'next': 0.0}
+        _async_host_state[host] = state
+
+    await state['sem'].acquire()
+    async with state['lock']:
+        loop = asyncio.get_running_loop()
+        delay = state['next'] - loop.time()
+        if delay > 0: await asyncio.sleep(delay)
+        state['next'] = loop.time() + min_interval
+    return state['sem']
+
+async def probe_single_hop_async(session, url, headers):
+    """Bản async của probe_single_hop"""
+    timeouts = get_link_timeouts(url)
+    try:
+        return await _probe_single_hop_async(session, url, headers, timeouts)
+    except asyncio.TimeoutError:
+        observe_host_timeout(get_link_host(url))
+        ceiling = get_ceiling_timeouts()
+        if timeouts == ceiling: raise
+        count_stat("TIMEOUT_STATS", "retried")
+    try:
+        return await _probe_single_hop_async(session, url, headers, ceiling)
+    except asyncio.TimeoutError:
+        observe_host_timeout(get_link_host(url))
+        raise
+
+async def _probe_single_hop_async(session, url, headers, timeouts):
+    import aiohttp
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeouts[0], sock_read=timeouts[1])
+    async with session.head(url, headers=headers, timeout=timeout, allow_redirects=False) as response:
+        if response.status not in (405, 501):
+            record_probe("head", 0, get_declared_page_size(response.headers))
+            return response.status, get_redirect_target(url, response.status, response.headers)
+
+    range_headers = dict(headers, Range='bytes=0-0')
+    bytes_read = 0
+    async with session.get(url, headers=range_headers, timeout=timeout, allow_redirects=False) as response:
+        page_size = get_declared_page_size(response.headers)
+        if response.status == 206 or page_size <= PROBE_SMALL_BODY:
+            async for chunk in response.content.iter_chunked(8192):
+                bytes_read += len(chunk)
+                if bytes_read > PROBE_SMALL_BODY: break
+        record_probe("range_get", bytes_read, page_size)
+        return response.status, get_redirect_target(url, response.status, response.headers)
+
+async def probe_link_status_async(session, url, headers):
+    """Bản async của probe_link_status (dùng chung cache redirect)"""
+    import aiohttp
+    current, hops = url, 0
+    while True:
+        # Cache SQLite là I/O chặn -> chạy ở luồng phụ, không giữ event loop
+        hop = await asyncio.to_thread(get_cached_hop, current)
+        if hop is None:
+            hop = await probe_single_hop_async(session, current, headers)
+            await asyncio.to_thread(store_cached_hop, current, *hop)
+        code, next_url = hop
+        if not next_url: return code
+        hops += 1
+        if hops > MAX_REDIRECTS:
+            raise aiohttp.ClientError(f"Exceeded {MAX_REDIRECTS} redirects.")
+        current = next_url
+
+async def check_single_link_async(url, scope=None):
+    """Bản async của check_single_link_detailed, cho ra đúng cùng cách phân loại OK/ERROR"""
+    set_timing_scope(scope)  # Mỗi task có context riêng -> chỉ áp dụng cho lần check này
+    cached = await asyncio.to_thread(get_cached_link_result, url)
+    if cached: return cached
+    hostname = get_url_hostname(url)
+    if hostname and not is_ip_literal(hostname):
+        resolved = await asyncio.wrap_future(prefetch_hostname(hostname))
+        if isinstance(resolved, socket.gaierror) and is_dns_error(resolved):
+            return await asyncio.to_thread(dns_dead_verdict, url, resolved)  # Ghi cache SQLite -> không chạy trên event loop
+
+    import aiohttp
+    session = await _get_async_session()
+    host_sem = await _acquire_async_host_slot(get_link_host(url))
+    code = None
+    started = time.perf_counter()
+    try:
+        code = await probe_link_status_async(session, url, build_link_headers())
+        result = classify_status_code(url, code)
+
+    except asyncio.TimeoutError:
+        result = classify_timeout(url)
+
+    except aiohttp.ClientConnectionError as e:
+        result = classify_connection_error(url, e)
+
+    except aiohttp.ClientError as e:
+        result = ("ERROR", f"Error ({str(e)})")
+
+    finally:
+        host_sem.release()
+
+    record_phase("link.probe", time.perf_counter() - started)
+    await asyncio.to_thread(store_cached_verdict, url, result, code)
+    return result
+
+async def _close_async_session():
+    global _async_session
+    if _async_session is not None:
+        await _async_session.close()
+        _async_session = None
+
+# --- BỘ LẬP LỊCH CHECK LINK TOÀN LƯỢT CHẠY ---
+
+def extract_external_links(text):
+    """Tách các link ngoài (đã làm sạch, khử trùng, giữ thứ tự) từ một đoạn text"""
     if not text: return []
     urls = re.findall(r'(https?://\S+)', text)
-    cleaned_urls = list(set([u.rstrip('.,;)"\'') for u in urls]))
-    external_links = [u for u in cleaned_urls if not any(d in u for d in ['youtube.com', 'youtu.be', 'google.com'])]
+    # Khử trùng theo khóa chuẩn: các biến thể (utm_*, http/https, / cuối...) chỉ giữ lần xuất hiện đầu
+    unique_urls = {}
+    for u in urls:
+        u = u.rstrip('.,;)"\'')
+        if not is_internal_link(u): unique_urls.setdefault(canonicalize_url(u), u)
+    return list(unique_urls.values())
+
+def get_host_policy(host):
+    """Trả về (max_in_flight, min_interval) cho host, ưu tiên cấu hình riêng trong HOST_POLICY"""
+    for domain, policy in HOST_POLICY.items():
+        if host == domain or host.endswith('.' + domain): return policy
+    return LINK_HOST_MAX_IN_FLIGHT, LINK_HOST_MIN_INTERVAL
+
+def _next_link_job():
+    """Chọn việc tiếp theo theo vòng tròn giữa các host còn slot trống và đã hết thời gian giãn cách"""
+    while True:
+        now = time.monotonic()
+        wait_time = None
+        for _ in range(len(_host_round_robin)):
+            host = _host_round_robin[0]
+            _host_round_robin.rotate(-1)
+            max_in_flight, min_interval = get_host_policy(host)
+            if _host_in_flight.get(host, 0) >= max_in_flight: continue
+
+            ready_at = _host_next_time.get(host, 0)
+            if ready_at > now:
+                wait_time = ready_at - now if wait_time is None else min(wait_time, ready_at - now)
+                continue
+
+            queue = _host_queues[host]
+            url, future, scope = queue.popleft()
+            if not queue:
+                del _host_queues[host]
+                _host_round_robin.remove(host)
+            _host_in_flight[host] = _host_in_flight.get(host, 0) + 1
+            _host_next_time[host] = now + min_interval
+            return host, url, future, scope
+
+        if _link_closing and not _host_round_robin: return None
+        _link_cond.wait(wait_time)
+
+def _link_worker():
+    while True:
+        with _link_cond:
+            job = _next_link_job()
+        if job is None: return
+
+        host, url, future, scope = job
+        # Thời gian thăm dò được tính cho kênh đã gửi link này lên đầu tiên
+        set_timing_scope(scope)
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(check_single_link_detailed(url))
+            except Exception as e:
+                future.set_exception(e)
+
+        with _link_cond:
+            _host_in_flight[host] -= 1
+            _link_cond.notify_all()
+
+def submit_link_check(url):
+    """Đưa URL vào hàng đợi theo host. Mỗi khóa chuẩn (canonicalize_url) chỉ được check 1 lần trong cả lượt chạy."""
+    key = canonicalize_url(url)
+    hostname = get_url_hostname(url)
+    dns_error = None
+    with _link_cond:
+        variants = CANONICAL_VARIANTS.setdefault(key, [])
+        if url not in variants: variants.append(url)
+        future = LINK_FUTURES.get(key)
+        if future is not None: return future
+        if _parent_link_queues is not None:
+            # Tiến trình con (shard): tiến trình cha check, kết quả về qua _receive_parent_links
+            future = concurrent.futures.Future()
+            LINK_FUTURES[key] = future
+            _parent_link_queues[1].put((_parent_link_queues[0], url))
+            return future
+        # Bắt đầu phân giải tên miền ngay (chạy nền), link chưa tới lượt check thì địa chỉ đã có sẵn trong cache
+        if hostname and not is_ip_literal(hostname):
+            dns_future = prefetch_hostname(hostname)
+            if dns_future.done() and isinstance(dns_future.result(), socket.gaierror) and is_dns_error(dns_future.result()):
+                dns_error = dns_future.result()
 
+        if dns_error is not None:
+            # Tên miền đã biết là không tồn tại -> không cần xếp hàng theo host
+            future = concurrent.futures.Future()
+            LINK_FUTURES[key] = future
+        elif LINK_ENGINE == 'async':
+            future = asyncio.run_coroutine_threadsafe(check_single_link_async(url, get_timing_scope()), _start_async_engine())
+            LINK_FUTURES[key] = future
+        else:
+            if not _link_workers:
+                for _ in range(LINK_CHECK_WORKERS):
+                    worker = threading.Thread(target=_link_worker, daemon=True)
+                    worker.start()
+                    _link_workers.append(worker)
+
+            future = concurrent.futures.Future()
+            LINK_FUTURES[key] = future
+            host = get_link_host(url)
+            if host not in _host_queues:
+                _host_queues[host] = collections.deque()
+                _host_round_robin.append(host)
+            _host_queues[host].append((url, future, get_timing_scope()))
+            _link_cond.notify()
+
+    if dns_error is not None:
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(get_cached_link_result(url) or dns_dead_verdict(url, dns_error))
+        except Exception as e:
+            future.set_exception(e)
+    return future
+
+def schedule_text_links(text):
+    for url in extract_external_links(text):
+        submit_link_check(url)
+
+def shutdown_link_checker():
+    """Chờ hàng đợi chạy hết rồi dừng các luồng check link"""
+    global _link_closing
+    with _link_cond:
+        _link_closing = True
+        workers = list(_link_workers)
+        _link_cond.notify_all()
+    for worker in workers: worker.join()
+    with _link_cond:
+        _link_workers.clear()
+        _link_closing = False
+
+    if _async_loop is not None:
+        concurrent.futures.wait(list(LINK_FUTURES.values()))
+        asyncio.run_coroutine_threadsafe(_close_async_session(), _async_loop).result()
+
+    global _dns_pool
+    with _dns_lock:
+        dns_pool, _dns_pool = _dns_pool, None
+    if dns_pool is not None: dns_pool.shutdown()
+
+def audit_text_links_return_list(text, source_type, report=None):
+    report = report or DEFAULT_REPORT
+    external_links = extract_external_links(text)
     if not external_links: return []
 
-    STATS["total_links_found"] += len(external_links)
+    report["stats"]["total_links_found"] += len(external_links)
     results_list = []
 
-    # Check link song song (10 luồng)
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_url = {executor.submit(check_single_link_detailed, url): url for url in external_links}
-        for future in concurrent.futures.as_completed(future_to_url):
-            url = future_to_url[future]
-            status_type, msg = future.result()
-            
-            if status_type == "INTERNAL": continue
-            
-            display_line = f"{url} -> [{msg}]"
-            results_list.append(display_line)
-            
-            if status_type == "ERROR":
-                STATS["links_error"] += 1
-                email_error_lines.append(f"[{source_type}] {display_line}")
-            else:
-                STATS["links_ok"] += 1
+    # Kết quả lấy từ pool chung (link đã được gửi đi từ trước thì chỉ việc chờ)
+    for url in external_links:
+        status_type, msg = submit_link_check(url).result()
+
+        if status_type == "INTERNAL": continue
+
+        display_line = f"{url} -> [{msg}]"
+        final_url, hops = follow_cached_hops(get_checked_url(url))
+        if hops: display_line += f" => {final_url} ({hops} redirect)"
+        results_list.append(display_line)
+
+        if status_type == "ERROR":
+            report["stats"]["links_error"] += 1
+            add_error_line(report, f"[{source_type}] {display_line}")
+        else:
+            report["stats"]["links_ok"] += 1
     return results_list
 
-def audit_end_screens_return_list(video_id):
-    url = f"https://www.youtube.com/watch?v={video_id}"
-    results_list = []
+# --- MÀN HÌNH KẾT THÚC (END SCREEN) ---
+
+def find_literal(pattern, literal, text, start, end):
+    """Dò nhanh bằng str.find theo phần chữ cố định rồi mới match regex tại vị trí đó"""
+    pos = text.find(literal, start, end)
+    while pos != -1:
+        match = pattern.match(text, pos, end)
+        if match: return match
+        pos = text.find(literal, pos + 1, end)
+    return None
+
+def extract_endscreen_from_chunks(chunks):
+    """
+    Quét các đoạn HTML theo thứ tự, chỉ giải mã khối "endscreen" của ytInitialPlayerResponse và
+    ngừng lấy thêm chunk ngay khi khối này đã đủ. Trả về dict endscreen, hoặc None nếu player response không có endscreen.
+    Trang không có player response (trang consent, trang lỗi...) hoặc bị cắt giữa chừng thì raise ValueError.
+
+    Trong HTML của YouTube, JSON nhúng luôn escape '<' và '"' trong chuỗi nên cả khóa "endscreen"
+    lẫn thẻ </script> (điểm kết thúc player response) đều tìm được bằng phép tìm chuỗi thường.
+    Khối endscreen được cắt theo ngoặc cân bằng bằng raw_decode (bộ quét C của module json),
+    không phải parse cả player response.
+    """
+    buffer = ''
+    found_start = False
+    search_from = 0
+
+    for chunk in chunks:
+        buffer += chunk
+        if not found_start:
+            match = find_literal(PLAYER_RESPONSE_MARKER, 'ytInitialPlayerResponse', buffer, 0, len(buffer))
+            if not match:
+                buffer = buffer[-64:]  # Giữ phần đuôi phòng trường hợp marker bị cắt giữa 2 chunk
+                continue
+            found_start = True
+            buffer = buffer[match.end() - 1:]
+
+        script_end = buffer.find('</script>', search_from)
+        region_end = script_end if script_end != -1 else len(buffer)
+        key = find_literal(_ENDSCREEN_KEY, '"endscreen"', buffer, search_from, region_end)
+        if key:
+            try:
+                return _JSON_DECODER.raw_decode(buffer, key.end())[0]
+            except ValueError:
+                # Khối endscreen chưa tải đủ -> chờ chunk sau (trừ khi player response đã kết thúc)
+                if script_end != -1: raise
+                search_from = key.start()
+                continue
+        if script_end != -1: return None
+        search_from = max(0, len(buffer) - 64)
+    if not found_start: raise ValueError("Trang không có ytInitialPlayerResponse")
+    raise ValueError("Trang bị cắt trước khi hết ytInitialPlayerResponse")
+
+def iter_watch_page_text(response, read_stats):
+    """Giải mã UTF-8 từng chunk của response, cộng số byte và thời gian chờ mạng vào read_stats"""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    chunks = response.iter_content(WATCH_PAGE_CHUNK_SIZE)
+    while True:
+        started = time.perf_counter()
+        raw_chunk = next(chunks, None)
+        read_stats["seconds"] += time.perf_counter() - started
+        if raw_chunk is None: return
+        read_stats["bytes"] += len(raw_chunk)
+        count_stat("WATCH_PAGE_STATS", "bytes_read", len(raw_chunk))
+        yield decoder.decode(raw_chunk)
+
+def get_end_screen_targets(video_id):
+    """Tải trang xem video, trả về danh sách (loại, ID) các phần tử end screen trỏ tới video/playlist (None nếu tải lỗi)"""
+    url = WATCH_PAGE_URL.format(video_id)
+    targets = []
     try:
         headers = {'User-Agent': 'Mozilla/5.0'}
-        response = requests.get(url, headers=headers, timeout=10)
-        html = response.text
-        match = re.search(r'var ytInitialPlayerResponse\s*=\s*({.+?});', html)
-        if not match: return []
-
+        started = time.perf_counter()
+        response = requests.get(url, headers=headers, timeout=10, stream=True)
+        count_stat("WATCH_PAGE_STATS", "pages")
+        if response.status_code != 200:
+            # 429/5xx... không phải "video không có end screen" -> trả None để không lưu vào chỉ mục
+            response.close()
+            return None
+        # watch_page.fetch = chờ header + đọc body, watch_page.parse = phần còn lại (giải mã, tìm và parse khối endscreen)
+        header_seconds = time.perf_counter() - started
+        read_stats = {"seconds": 0.0, "bytes": 0}
+        parse_started = time.perf_counter()
         try:
-            data = json.loads(match.group(1))
-            end_screen_elements = data['endscreen']['endScreenRenderer']['elements']
-        except: return []
+            try:
+                endscreen = extract_endscreen_from_chunks(iter_watch_page_text(response, read_stats))
+            except (requests.RequestException, ValueError):
+                return None  # Đứt kết nối giữa chừng hoặc không đọc được player response
+            # Chỉ khi player response đọc được mà không có endScreenRenderer mới là video không có end screen
+            end_screen_elements = ((endscreen or {}).get('endScreenRenderer') or {}).get('elements', [])
+        finally:
+            response.close()
+            record_phase("watch_page.fetch", header_seconds + read_stats["seconds"], read_stats["bytes"])
+            record_phase("watch_page.parse", time.perf_counter() - parse_started - read_stats["seconds"])
 
         for el in end_screen_elements:
             try:
-                target_id = None
-                element_type = "Unknown"
                 if 'endScreenVideoRenderer' in el:
                     renderer = el['endScreenVideoRenderer']
                     if 'videoId' in renderer:
-                        target_id = renderer['videoId']
-                        element_type = "Video"
-                    else: continue
+                        targets.append(("Video", renderer['videoId']))
                 elif 'endScreenPlaylistRenderer' in el:
                     renderer = el['endScreenPlaylistRenderer']
                     if 'playlistId' in renderer:
-                        target_id = renderer['playlistId']
-                        element_type = "Playlist"
-
-                if target_id:
-                    api_status = "OK"
-                    if element_type == "Video":
-                        check = youtube.videos().list(id=target_id, part='status').execute()
-                        if not check['items']: api_status = "DEAD"
-                    elif element_type == "Playlist":
-                        check = youtube.playlists().list(id=target_id, part='status').execute()
-                        if not check['items']: api_status = "DEAD"
-                    
-                    if api_status == "DEAD":
-                        msg = f"{element_type} {target_id} bị xóa/ẩn"
-                        results_list.append(msg)
-                        STATS["endscreen_issues"] += 1
-                        email_error_lines.append(f"[EndScreen] {msg}")
+                        targets.append(("Playlist", renderer['playlistId']))
             except: continue
-    except: pass
+    except: return None
+    return targets
+
+def validate_end_screen_targets(targets):
+    """Check tồn tại theo lô 50 ID/lần gọi API, chỉ với các ID chưa có trong ENDSCREEN_STATUS"""
+    with _endscreen_lock:
+        _validate_end_screen_targets(targets)
+
+def build_status_request(element_type, ids):
+    if element_type == "Playlist":
+        return lambda youtube: youtube.playlists().list(id=ids, part='status', maxResults=50)
+    return lambda youtube: youtube.videos().list(id=ids, part='status')
+
+def _validate_end_screen_targets(targets):
+    # Mọi nhóm 50 ID (cả Video lẫn Playlist) đi chung 1 batch HTTP, lỗi của nhóm nào chỉ ảnh hưởng nhóm đó
+    submitted = []
+    for element_type in ("Video", "Playlist"):
+        pending = list(dict.fromkeys(
+            target_id for t, target_id in targets if t == element_type and (t, target_id) not in ENDSCREEN_STATUS
+        ))
+        for i in range(0, len(pending), 50):
+            chunk = pending[i:i+50]
+            future = get_api_batcher().submit(build_status_request(element_type, ','.join(chunk)))
+            submitted.append((element_type, i, chunk, future))
+
+    for element_type, i, chunk, future in submitted:
+        try:
+            check = future.result()
+            count_stat("ENDSCREEN_API_STATS", "api_calls")
+        except Exception as e:
+            # Lỗi API thì không kết luận gì, các ID này sẽ được bỏ qua như trước
+            log(f"Lỗi khi check end screen nhóm {element_type} {i}-{i+50}: {e}")
+            continue
+        found_ids = {item['id'] for item in check.get('items', [])}
+        for target_id in chunk:
+            ENDSCREEN_STATUS[(element_type, target_id)] = target_id in found_ids
+
+def audit_end_screens_return_list(video_id, targets=None, report=None):
+    report = report or DEFAULT_REPORT
+    if targets is None:
+        targets = get_end_screen_targets(video_id) or []
+    validate_end_screen_targets(targets)
+
+    results_list = []
+    for element_type, target_id in targets:
+        count_stat("ENDSCREEN_API_STATS", "targets")
+        if ENDSCREEN_STATUS.get((element_type, target_id)) is False:
+            msg = f"{element_type} {target_id} bị xóa/ẩn"
+            results_list.append(msg)
+            report["stats"]["endscreen_issues"] += 1
+            add_error_line(report, f"[EndScreen] {msg}")
     return results_list
 
-def get_long_videos(channel_id):
+def iter_upload_pages(channel_id):
+    """Duyệt playlist uploads của kênh, mỗi lần trả về 1 trang (tối đa 50) video ID"""
+    ch_response = get_youtube().channels().list(id=channel_id, part='contentDetails').execute()
+    if not ch_response['items']: return
+    uploads_playlist_id = ch_response['items'][0]['contentDetails']['relatedPlaylists']['uploads']
+    
+    next_page_token = None
+    while True:
+        pl_request = get_youtube().playlistItems().list(playlistId=uploads_playlist_id, part='contentDetails', maxResults=50, pageToken=next_page_token)
+        pl_response = pl_request.execute()
+        video_ids = [item['contentDetails']['videoId'] for item in pl_response['items']]
+        if video_ids: yield video_ids
+        
+        next_page_token = pl_response.get('nextPageToken')
+        if not next_page_token: break
+
+def fetch_long_video_details(video_ids):
+    """Lấy snippet/contentDetails/statistics cho 1 trang ID, chỉ giữ video dài"""
     long_videos = []
-    try:
-        ch_response = youtube.channels().list(id=channel_id, part='contentDetails').execute()
-        if not ch_response['items']: return []
-        uploads_playlist_id = ch_response['items'][0]['contentDetails']['relatedPlaylists']['uploads']
+    vid_request = get_youtube().videos().list(id=','.join(video_ids), part='snippet,contentDetails,statistics')
+    vid_response = vid_request.execute()
+    for item in vid_response['items']:
+        # LỌC SHORTS BẰNG THỜI GIAN (> 125 giây)
+        duration = parse_duration(item['contentDetails']['duration'])
+        if duration <= 125: continue 
         
-        next_page_token = None
-        log("Đang tải danh sách video...")
-        while True:
-            pl_request = youtube.playlistItems().list(playlistId=uploads_playlist_id, part='contentDetails', maxResults=50, pageToken=next_page_token)
-            pl_response = pl_request.execute()
-            video_ids = [item['contentDetails']['videoId'] for item in pl_response['items']]
-            
-            if video_ids:
-                vid_request = youtube.videos().list(id=','.join(video_ids), part='snippet,contentDetails')
-                vid_response = vid_request.execute()
-                for item in vid_response['items']:
-                    # LỌC SHORTS BẰNG THỜI GIAN (> 125 giây)
-                    duration = parse_duration(item['contentDetails']['duration'])
-                    if duration <= 125: continue 
-                    
-                    long_videos.append({'id': item['id'], 'title': item['snippet']['title'], 'desc': item['snippet']['description']})
-            
-            next_page_token = pl_response.get('nextPageToken')
-            if not next_page_token: break
-    except Exception as e:
-        log(f"Lỗi khi lấy danh sách video: {e}")
+        long_videos.append({
+            'id': item['id'],
+            'title': item['snippet']['title'],
+            'desc': item['snippet']['description'],
+            'comment_count': item.get('statistics', {}).get('commentCount')
+        })
     return long_videos
 
-def send_email_with_csv(total_issues_count, channel_name, crash_message=None):
+def submit_top_comments(video_id):
+    """Đưa lệnh lấy 10 comment nổi bật vào batch API, trả về Future"""
+    return get_api_batcher().submit(lambda youtube: youtube.commentThreads().list(
+        videoId=video_id, part='snippet', maxResults=10, order='relevance', textFormat='plainText'
+    ))
+
+def get_top_comments(video_id, future=None):
+    """Lấy nội dung 10 comment nổi bật của video (None nếu gọi API lỗi, [] nếu video tắt comment).
+    Hết quota/bị hoãn vì quota thì raise QuotaExhausted/QuotaDeferred để video được quét lại ở lượt sau.
+    future: lệnh submit_top_comments() đã gửi trước, không có thì gửi ngay."""
+    comments = []
+    try:
+        cmt_res = (future or submit_top_comments(video_id)).result()
+        for item in cmt_res.get('items', []):
+            comments.append(item['snippet']['topLevelComment']['snippet']['textDisplay'])
+    except HttpError as e:
+        if 'commentsDisabled' not in str(e): return None
+    except QuotaExhausted: raise
+    except: return None
+    return comments
+
+def send_email_with_csv(total_issues_count, channel_name, crash_message=None, report=None):
+    report = report or DEFAULT_REPORT
+    stats = report["stats"]
     msg = MIMEMultipart()
     msg['From'] = EMAIL_USER
     msg['To'] = EMAIL_TO
     
-    # CSV Attachment
-    csv_buffer = io.StringIO()
-    csv_writer = csv.writer(csv_buffer)
-    csv_writer.writerow(CSV_HEADER)
-    csv_writer.writerows(CSV_DATA)
-    csv_bytes = csv_buffer.getvalue().encode('utf-8-sig')
-    filename = f"Bao_Cao_{channel_name.replace(' ', '_')}.csv"
-    attachment = MIMEApplication(csv_bytes, Name=filename)
-    attachment['Content-Disposition'] = f'attachment; filename="{filename}"'
-    msg.attach(attachment)
+    # CSV Attachment (đọc từ file đã ghi dần trong lúc quét)
+    close_report_csv(report)
+    if report.get("csv_path") and os.path.exists(report["csv_path"]):
+        with open(report["csv_path"], 'rb') as f:
+            csv_bytes = f.read()
+        filename = f"Bao_Cao_{channel_name.replace(' ', '_')}.csv"
+        attachment = MIMEApplication(csv_bytes, Name=filename)
+        attachment['Content-Disposition'] = f'attachment; filename="{filename}"'
+        msg.attach(attachment)
+    if report.get("timing_json"):
+        attachment = MIMEApplication(report["timing_json"].encode('utf-8'), Name="Thoi_gian_xu_ly.json")
+        attachment['Content-Disposition'] = 'attachment; filename="Thoi_gian_xu_ly.json"'
+        msg.attach(attachment)
 
     summary_block = (
         f"=== THỐNG KÊ KÊNH: {channel_name} ===\n"
-        f"- Tổng video dài (>125s) đã quét: {STATS['videos_scanned']}\n"
-        f"- Link Tốt (OK): {STATS['links_ok']}\n"
-        f"- Link Lỗi (ERROR): {STATS['links_error']}\n"
+        f"- Tổng video dài (>125s) đã quét: {stats['videos_scanned']}\n"
+        f"- Link Tốt (OK): {stats['links_ok']}\n"
+        f"- Link Lỗi (ERROR): {stats['links_error']}\n"
+        + (f"- Video lỗi khi xử lý (chưa quét được): {stats['videos_failed']}\n" if stats.get('videos_failed') else "")
+        + (f"- Video chưa quét comment vì hết/hoãn quota (quét lại khi --resume): {stats['comments_skipped']}\n" if stats.get('comments_skipped') else "") +
         f"======================================\n\n"
     )
+    timing_lines = format_timing_summary(summarize_timing(report["channel_id"]))
+    timing_block = "\n\nThời gian theo bước (bước tốn nhiều thời gian nhất ở trên):\n" + "\n".join(timing_lines) if timing_lines else ""
 
     if crash_message:
         msg['Subject'] = f"[{channel_name}] ❌ LỖI HỆ THỐNG"
-        body_content = f"Lỗi: {crash_message}\n\n{summary_block}"
+        body_content = f"Lỗi: {crash_message}\n\n{summary_block}{timing_block}"
     elif total_issues_count == 0:
         msg['Subject'] = f"[{channel_name}] ✅ Kênh Sạch - Xem Excel"
-        body_content = f"{summary_block}Kênh hoạt động tốt. Xem file đính kèm."
+        body_content = f"{summary_block}Kênh hoạt động tốt. Xem file đính kèm.{timing_block}"
         log("✅ Đang gửi email báo cáo (Kênh sạch)...")
     else:
         msg['Subject'] = f"[{channel_name}] ⚠️ CẢNH BÁO - {total_issues_count} vấn đề"
-        body_content = f"{summary_block}Tóm tắt lỗi:\n" + "\n".join(email_error_lines[:15]) + \
-                       "\n\n... (Xem đầy đủ trong file Excel đính kèm)"
+        body_content = f"{summary_block}Tóm tắt lỗi:\n" + "\n".join(report["error_lines"][:15]) + \
+                       "\n\n... (Xem đầy đủ trong file Excel đính kèm)" + timing_block
         log("⚠️ Đang gửi email cảnh báo lỗi...")
 
     msg.attach(MIMEText(body_content, 'plain'))
     try:
+        started = time.perf_counter()
         server = smtplib.SMTP('smtp.gmail.com', 587)
         server.starttls()
         server.login(EMAIL_USER, EMAIL_PASS)
         server.send_message(msg)
         server.quit()
+        record_phase("smtp.send", time.perf_counter() - started, len(msg.as_bytes()))
         print(">> Đã gửi email thành công!")
     except Exception as e:
         print(f"Lỗi gửi email: {e}")
 
-def main():
-    log("=== BẮT ĐẦU QUÉT (FINAL VERSION) ===")
-    start_time = time.time()
-    total_issues_count = 0
-    current_channel_name = "Unknown Channel"
-    
-    try:
+# --- PIPELINE QUÉT VIDEO ---
+
+def start_pipeline_stage(name, handler, in_queue, out_queue, workers, stage_stats, on_error=None, batch_full=None):
+    """
+    Chạy handler(item, emit) trên `workers` luồng, đọc từ in_queue và đẩy kết quả sang out_queue.
+    Khi gặp _PIPELINE_DONE, worker cuối cùng của bước sẽ báo hết cho bước sau.
+    handler lỗi -> on_error(item, lỗi, emit) đẩy tiếp 1 mục báo lỗi (giữ nguyên seq) để bước ghi CSV không bị kẹt.
+    batch_full: bước xử lý theo lô -> gom thêm mục (chờ tối đa PIPELINE_BATCH_WAIT giây) tới khi batch_full(lô) trả True
+    rồi gọi handler(lô, emit) 1 lần. Số mục và thời gian bận vẫn tính theo từng mục (không tính lúc chờ gom), lỗi báo cho từng mục.
+    """
+    stats = stage_stats[name] = {"items": 0, "busy": 0.0, "queue": in_queue}
+    lock = threading.Lock()
+    remaining = [workers]
+
+    def worker():
+        while True:
+            item = in_queue.get()
+            if item is _PIPELINE_DONE:
+                in_queue.put(_PIPELINE_DONE)  # Để các worker khác cùng bước cũng dừng
+                with lock:
+                    remaining[0] -= 1
+                    if remaining[0] == 0: out_queue.put(_PIPELINE_DONE)
+                return
+            items = [item]
+            if batch_full: collect_batch(items)
+            started = time.monotonic()
+            try:
+                handler(items if batch_full else item, out_queue.put)
+            except Exception as e:
+                log(f"Lỗi ở bước {name}: {e}")
+                if on_error:
+                    for failed in items: on_error(failed, f"{name}: {e}", out_queue.put)
+            with lock:
+                stats["items"] += len(items)
+                stats["busy"] += time.monotonic() - started
+
+    def collect_batch(items):
+        deadline = time.monotonic() + PIPELINE_BATCH_WAIT
+        while not batch_full(items):
+            try:
+                item = in_queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                return
+            if item is _PIPELINE_DONE:
+                in_queue.put(item)  # Vòng lặp worker sẽ đọc lại và dừng sau khi xử lý xong lô này
+                return
+            items.append(item)
+
+    # Mỗi luồng chạy trong bản sao context của luồng tạo ra nó -> mẫu đo thời gian gắn đúng kênh
+    threads = [threading.Thread(target=contextvars.copy_context().run, args=(worker,), daemon=True) for _ in range(workers)]
+    for thread in threads: thread.start()
+    return threads
+
+def log_pipeline_status(channel_name, stage_stats, final=False):
+    if final:
+        for name, stats in stage_stats.items():
+            rate = stats["items"] / stats["busy"] if stats["busy"] else 0
+            log(f"[{channel_name}] Pipeline {name}: {stats['items']} mục, bận {round(stats['busy'], 2)} giây ({round(rate, 2)} mục/giây)")
+    else:
+        depths = ", ".join(f"{name}={stats['queue'].qsize()}" for name, stats in stage_stats.items())
+        log(f"[{channel_name}] Pipeline hàng đợi: {depths}")
+
+def run_channel_pipeline(report, iter_pages, processed):
+    """Quét các trang video ID do iter_pages() sinh ra qua pipeline, ghi từng dòng CSV của report theo đúng thứ tự"""
+    channel_name = report["channel_name"]
+    stats = report["stats"]
+
+    if LINK_ENGINE == 'async':
+        log(f"[{channel_name}] Bắt đầu pipeline, link được gửi vào engine async (tối đa {LINK_ASYNC_CONCURRENCY} kết nối)...")
+    else:
+        log(f"[{channel_name}] Bắt đầu pipeline, link được gửi vào pool check ({LINK_CHECK_WORKERS} luồng)...")
+
+    # Các bước nối với nhau bằng hàng đợi có giới hạn -> gọi API, tải trang và check link chồng lên nhau
+    page_queue = queue.Queue(PIPELINE_QUEUE_SIZE)
+    video_queue = queue.Queue(PIPELINE_QUEUE_SIZE)
+    fetched_queue = queue.Queue(PIPELINE_QUEUE_SIZE)
+    validated_queue = queue.Queue(PIPELINE_QUEUE_SIZE)
+    ready_queue = queue.Queue(PIPELINE_QUEUE_SIZE)
+    stage_stats = {}
+    sequence = [0]
+
+    # Mục lỗi (có khóa 'error') vẫn đi qua mọi bước với đúng seq của nó, bước ghi CSV cộng vào STATS và dòng lỗi của email
+    def next_seq_item(**fields):
+        fields['seq'] = sequence[0]
+        sequence[0] += 1
+        return fields
+
+    def forward_error(video, error, emit):
+        emit(dict(video, error=video.get('error') or error))
+
+    def pager():
         try:
-            ch_info = youtube.channels().list(id=CHANNEL_ID, part='snippet').execute()
-            if ch_info['items']:
-                current_channel_name = ch_info['items'][0]['snippet']['title']
-                log(f"Kênh: {current_channel_name}")
-        except: pass
+            for video_ids in iter_pages():
+                page_queue.put(video_ids)
+        except Exception as e:
+            log(f"Lỗi khi lấy danh sách video: {e}")
+            page_queue.put(e)
+        finally:
+            page_queue.put(_PIPELINE_DONE)
 
-        videos = get_long_videos(CHANNEL_ID)
-        STATS['videos_scanned'] = len(videos)
-        log(f"Tổng số video dài cần quét: {len(videos)}")
-        
-        for index, video in enumerate(videos):
+    def fetch_metadata(video_ids, emit):
+        if isinstance(video_ids, Exception):
+            emit(next_seq_item(id='', title='', error=f"danh sách video: {video_ids}"))
+            return
+        video_ids = [v for v in video_ids if v not in processed]
+        if not video_ids: return
+        try:
+            videos = fetch_long_video_details(video_ids)
+        except Exception as e:
+            log(f"Lỗi khi lấy thông tin {len(video_ids)} video: {e}")
+            emit(next_seq_item(id='', title='', error=f"metadata {len(video_ids)} video ({video_ids[0]}...): {e}"))
+            return
+        for video in videos:
+            video.update(next_seq_item())
+            try:
+                # Video mới/đã đổi -> gửi ngay lệnh lấy comment để cả trang (tối đa 50 video) đi chung 1 batch HTTP
+                video['indexed'] = load_video_index(video)
+                if not video['indexed']: video['comments_future'] = submit_top_comments(video['id'])
+            except Exception as e:
+                log(f"Lỗi ở bước metadata: {e}")
+                video['error'] = f"metadata: {e}"
+            emit(video)
+
+    def fetch_video_content(video, emit):
+        if 'error' in video:
+            emit(video)
+            return
+        schedule_text_links(video['desc'])
+
+        # Video không đổi -> lấy comment/end screen từ chỉ mục; link vẫn được check lại (cache còn hạn thì không tốn mạng)
+        indexed = video.pop('indexed')
+        if indexed:
+            video['comments'], video['endscreen'] = indexed
+            count_stat("VIDEO_INDEX_STATS", "reused")
+        else:
+            try:
+                comments = get_top_comments(video['id'], video.pop('comments_future'))
+            except QuotaExhausted as e:
+                # Chưa lấy được comment vì quota -> video chưa xong, không ghi dòng thiếu comment
+                emit(dict(video, error=f"comment: {e}", comments_skipped=True))
+                return
+            targets = get_end_screen_targets(video['id'])
+            video['comments'] = comments or []
+            video['endscreen'] = targets or []
+            # Chỉ lưu khi lấy dữ liệu thành công, lỗi tạm thời thì lần sau quét lại
+            if comments is not None and targets is not None: save_video_index(video)
+            count_stat("VIDEO_INDEX_STATS", "audited")
+
+        for cmt_text in video['comments']:
+            schedule_text_links(cmt_text)
+        emit(video)
+
+    def endscreen_batch_full(batch):
+        # Gom video cho đủ 50 ID chưa biết rồi mới gọi API 1 lần
+        return len({t for v in batch for t in v.get('endscreen', ()) if t not in ENDSCREEN_STATUS}) >= 50
+
+    def validate_end_screens(batch, emit):
+        # Lỗi của cả lô -> forward_error cho từng video đã gom, không video nào mất seq
+        validate_end_screen_targets([t for v in batch if 'error' not in v for t in v['endscreen']])
+        for v in batch: emit(v)
+
+    def wait_for_links(video, emit):
+        if 'error' in video:
+            emit(video)
+            return
+        for text in [video['desc']] + video['comments']:
+            for url in extract_external_links(text):
+                submit_link_check(url).result()
+        emit(video)
+
+    threading.Thread(target=contextvars.copy_context().run, args=(pager,), daemon=True).start()
+    start_pipeline_stage("metadata", fetch_metadata, page_queue, video_queue, 1, stage_stats)
+    start_pipeline_stage("fetch", fetch_video_content, video_queue, fetched_queue, PIPELINE_FETCH_WORKERS, stage_stats, forward_error)
+    start_pipeline_stage("endscreen", validate_end_screens, fetched_queue, validated_queue, 1, stage_stats, forward_error,
+                         batch_full=endscreen_batch_full)
+    start_pipeline_stage("links", wait_for_links, validated_queue, ready_queue, 1, stage_stats, forward_error)
+
+    # Bước cuối (luồng hiện tại): ghi dòng CSV theo đúng thứ tự playlist
+    pending = {}
+    next_seq = 0
+    last_status_log = time.monotonic()
+    while True:
+        try:
+            video = ready_queue.get(timeout=1)
+        except queue.Empty:
+            video = None
+        if time.monotonic() - last_status_log >= PIPELINE_LOG_INTERVAL:
+            log_pipeline_status(channel_name, stage_stats)
+            last_status_log = time.monotonic()
+        if video is None: continue
+        if video is _PIPELINE_DONE: break
+
+        pending[video['seq']] = video
+        while next_seq in pending:
+            video = pending.pop(next_seq)
+            next_seq += 1
+            if 'error' in video:
+                # Video lỗi không được đánh dấu đã xong -> lượt --resume sau sẽ quét lại
+                if video.get('comments_skipped'):
+                    stats['comments_skipped'] += 1
+                    report["quota_blocked"] = True  # Cả trường hợp bị hoãn (QuotaDeferred), quota_blocked() không đếm
+                    add_error_line(report, f"[Hoãn comment] {video['id']} - {video['error']}")
+                else:
+                    stats['videos_failed'] += 1
+                    add_error_line(report, f"[Lỗi xử lý] {video['id'] or 'Không rõ video'} - {video['error']}")
+                report["row_snapshot"] = (dict(stats), len(report["error_lines"]))
+                continue
+            row_started = time.perf_counter()
             vid_id = video['id']
-            log(f"[{index+1}/{len(videos)}] {video['title']}")
-            
-            desc_results = audit_text_links_return_list(video['desc'], "Mô tả")
+            stats['videos_scanned'] += 1
+            log(f"[{channel_name}] [{stats['videos_scanned']}] {video['title']}")
+
+            desc_results = audit_text_links_return_list(video['desc'], "Mô tả", report)
             
             cmt_results = []
-            try:
-                cmt_req = youtube.commentThreads().list(videoId=vid_id, part='snippet', maxResults=10, order='relevance', textFormat='plainText')
-                cmt_res = cmt_req.execute()
-                for item in cmt_res.get('items', []):
-                    cmt_text = item['snippet']['topLevelComment']['snippet']['textDisplay']
-                    cmt_results.extend(audit_text_links_return_list(cmt_text, "Comment"))
-            except: pass
+            for cmt_text in video['comments']:
+                cmt_results.extend(audit_text_links_return_list(cmt_text, "Comment", report))
 
-            es_results = audit_end_screens_return_list(vid_id)
+            es_results = audit_end_screens_return_list(vid_id, video['endscreen'], report)
 
             row = [
                 f"https://youtu.be/{vid_id}",
@@ -355,18 +1886,297 @@ def main():
                 "\n".join(cmt_results),
                 "\n".join(es_results)
             ]
-            CSV_DATA.append(row)
+            write_report_row(report, row)
+            record_phase("csv.row", time.perf_counter() - row_started)
+            report["processed"].append(vid_id)
+            report["row_snapshot"] = (dict(stats), len(report["error_lines"]))
+            if report.get("checkpoint", True) and len(report["processed"]) % CHECKPOINT_INTERVAL == 0:
+                save_checkpoint(report)
+
+    log_pipeline_status(channel_name, stage_stats, final=True)
+
+# --- CHẠY NHIỀU TIẾN TRÌNH (SHARD) ---
+
+def get_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # spawn thay vì fork: tiến trình cha đang có nhiều luồng (pool check link, batch API)
+            _process_pool = concurrent.futures.ProcessPoolExecutor(AUDIT_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+        return _process_pool
+
+def shutdown_process_pool():
+    global _process_pool
+    global _link_manager
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown()
+            _process_pool = None
+        if _link_manager is not None:
+            _link_manager.shutdown()
+            _link_manager = None
 
-        total_issues_count = STATS['links_error'] + STATS['endscreen_issues']
+def get_link_manager():
+    global _link_manager
+    with _process_pool_lock:
+        if _link_manager is None:
+            _link_manager = multiprocessing.get_context('spawn').Manager()
+        return _link_manager
+
+def serve_shard_links(request_queue, response_queues, scope):
+    """Chạy trong tiến trình cha: check link các shard gửi về bằng pool check link chung, trả verdict về đúng shard"""
+    set_timing_scope(scope)
+    while True:
+        item = request_queue.get()
+        if item is None: return
+        shard_index, url = item
+        submit_link_check(url).add_done_callback(functools.partial(_reply_shard_link, response_queues[shard_index], url))
+
+def _reply_shard_link(response_queue, url, future):
+    try:
+        response_queue.put((url, future.result(), None))
+    except Exception as e:
+        response_queue.put((url, None, f"{type(e).__name__}: {e}"))
+
+def _receive_parent_links(response_queue):
+    """Chạy trong tiến trình con: nhận verdict từ tiến trình cha và hoàn tất Future của link tương ứng"""
+    while True:
+        item = response_queue.get()
+        if item is None: return
+        url, result, error = item
+        with _link_cond:
+            future = LINK_FUTURES[canonicalize_url(url)]
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(RuntimeError(error))
+
+def shard_part_path(channel_id, shard_index):
+    return os.path.join(REPORT_DIR, f"Bao_Cao_{channel_id}.part{shard_index}.csv")
+
+def remove_shard_parts(channel_id):
+    """Xóa CSV tạm của các shard (còn sót lại khi lượt trước bị lỗi giữa chừng)"""
+    if not os.path.isdir(REPORT_DIR): return
+    for name in os.listdir(REPORT_DIR):
+        if fnmatch.fnmatch(name, f"Bao_Cao_{channel_id}.part*.csv"):
+            os.remove(os.path.join(REPORT_DIR, name))
+
+def collect_run_stats():
+    """Bộ đếm toàn cục của tiến trình hiện tại (tiến trình con gửi về để tiến trình cha in thống kê chung)"""
+    merge_thread_counters()
+    return {
+        "LINK_CACHE_STATS": dict(LINK_CACHE_STATS),
+        "REDIRECT_STATS": dict(REDIRECT_STATS),
+        "VIDEO_INDEX_STATS": dict(VIDEO_INDEX_STATS),
+        "ENDSCREEN_API_STATS": dict(ENDSCREEN_API_STATS),
+        "WATCH_PAGE_STATS": dict(WATCH_PAGE_STATS),
+        "PROBE_STATS": dict(PROBE_STATS),
+        "TIMEOUT_STATS": dict(TIMEOUT_STATS),
+        "DNS_STATS": dict(DNS_STATS),
+        "API_BATCH_STATS": dict(youtube_quota.API_BATCH_STATS),
+        "QUOTA_RUN_STATS": {endpoint: dict(s) for endpoint, s in youtube_quota.QUOTA_RUN_STATS.items()},
+        "canonical": (sum(len(v) for v in CANONICAL_VARIANTS.values()), len(CANONICAL_VARIANTS)),
+    }
+
+def merge_worker_stats():
+    """Cộng bộ đếm của các tiến trình con vào bộ đếm của tiến trình cha (gọi 1 lần trước khi in thống kê cuối)"""
+    for worker_stats in WORKER_RUN_STATS.values():
+        for name in ["LINK_CACHE_STATS", "REDIRECT_STATS", "VIDEO_INDEX_STATS", "ENDSCREEN_API_STATS", "WATCH_PAGE_STATS", "PROBE_STATS", "TIMEOUT_STATS", "DNS_STATS"]:
+            target = globals()[name]
+            for key, value in worker_stats[name].items():
+                target[key] = max(target[key], value) if key == "max_open_fds" else target[key] + value
+        for key, value in worker_stats["API_BATCH_STATS"].items():
+            youtube_quota.API_BATCH_STATS[key] += value
+        for endpoint, s in worker_stats["QUOTA_RUN_STATS"].items():
+            target = youtube_quota.QUOTA_RUN_STATS.setdefault(endpoint, dict.fromkeys(s, 0))
+            for key, value in s.items(): target[key] += value
+        # Link cần check đã được đếm ở tiến trình cha (shard gửi về 1 URL mỗi khóa chuẩn) -> chỉ cộng số biến thể gộp được trong shard
+        WORKER_EXTRA_VARIANTS[0] += worker_stats["canonical"][0] - worker_stats["canonical"][1]
+    WORKER_RUN_STATS.clear()
+
+def audit_shard(channel_id, channel_name, shard_index, video_ids, request_queue, response_queue):
+    """Chạy trong tiến trình con: quét 1 shard video của kênh vào file CSV riêng, trả về STATS/dòng lỗi để tiến trình cha gộp.
+    Link gửi về tiến trình cha qua request_queue, verdict nhận lại qua response_queue."""
+    global _parent_link_queues
+    report = new_channel_report(channel_id, f"{channel_name} #{shard_index + 1}")
+    report["checkpoint"] = False  # Checkpoint do tiến trình cha ghi sau khi gộp từng shard
+    set_timing_scope(channel_id)
+    mark = timing_mark()
+    _parent_link_queues = (shard_index, request_queue)
+    receiver = threading.Thread(target=_receive_parent_links, args=(response_queue,), daemon=True)
+    receiver.start()
+    open_report_csv(report, shard_part_path(channel_id, shard_index), header=False)
+    try:
+        pages = [video_ids[i:i + 50] for i in range(0, len(video_ids), 50)]
+        run_channel_pipeline(report, lambda: iter(pages), set())
+    finally:
+        response_queue.put(None)
+        receiver.join()
+        _parent_link_queues = None
+        close_report_csv(report)
+        shutdown_link_checker()
+        close_api_batcher()
+        flush_quota_ledger()
+    return {
+        "csv_path": report["csv_path"],
+        "stats": report["stats"],
+        "error_lines": report["error_lines"],
+        "processed": report["processed"],
+        "quota_blocked": quota_blocked() or report.get("quota_blocked", False),
+        "pid": os.getpid(),
+        "run_stats": collect_run_stats(),
+        "timings": timing_samples(mark),
+    }
+
+def merge_shard_result(report, result):
+    """Nối CSV của shard vào báo cáo chính, cộng STATS/dòng lỗi rồi ghi checkpoint"""
+    with open(result["csv_path"], newline='', encoding='utf-8-sig') as part:
+        shutil.copyfileobj(part, report["csv_file"])
+    report["csv_file"].flush()
+    os.remove(result["csv_path"])
+    for key, value in result["stats"].items():
+        report["stats"][key] += value
+    for line in result["error_lines"]: add_error_line(report, line)
+    report["processed"].extend(result["processed"])
+    report["quota_blocked"] = report.get("quota_blocked") or result["quota_blocked"]
+    WORKER_RUN_STATS[result["pid"]] = result["run_stats"]
+    merge_timing_samples(result["timings"])
+    report["row_snapshot"] = (dict(report["stats"]), len(report["error_lines"]))
+    save_checkpoint(report)
+
+def run_channel_shards(report, processed):
+    """Chia video của kênh thành các shard chạy song song trên pool tiến trình, gộp kết quả theo đúng thứ tự playlist"""
+    channel_name = report["channel_name"]
+    video_ids = [v for page in iter_upload_pages(report["channel_id"]) for v in page if v not in processed]
+    shard_size = max(1, min(AUDIT_SHARD_SIZE, -(-len(video_ids) // AUDIT_PROCESSES)))
+    shards = [video_ids[i:i + shard_size] for i in range(0, len(video_ids), shard_size)]
+    log(f"[{channel_name}] Chia {len(video_ids)} video thành {len(shards)} shard cho {AUDIT_PROCESSES} tiến trình")
+
+    remove_shard_parts(report["channel_id"])
+    manager = get_link_manager()
+    request_queue = manager.Queue()
+    response_queues = [manager.Queue() for _ in shards]
+    server = threading.Thread(target=serve_shard_links, args=(request_queue, response_queues, get_timing_scope()), daemon=True)
+    server.start()
+    pool = get_process_pool()
+    futures = [pool.submit(audit_shard, report["channel_id"], channel_name, index, shard, request_queue, response_queues[index])
+               for index, shard in enumerate(shards)]
+    try:
+        for index, future in enumerate(futures):
+            merge_shard_result(report, future.result())
+            log(f"[{channel_name}] Đã gộp shard {index + 1}/{len(shards)} ({report['stats']['videos_scanned']} video)")
+    finally:
+        # Shard lỗi: hủy các shard chưa chạy, chờ shard đang chạy xong rồi mới xóa CSV tạm của chúng
+        for future in futures: future.cancel()
+        concurrent.futures.wait(futures)
+        request_queue.put(None)
+        server.join()
+        remove_shard_parts(report["channel_id"])
+
+def audit_channel(report):
+    """Quét 1 kênh và gửi email báo cáo riêng của kênh đó"""
+    start_time = time.time()
+    total_issues_count = 0
+    channel_id = report["channel_id"]
+    stats = report["stats"]
+    set_timing_scope(channel_id)
+    
+    try:
+        try:
+            ch_info = get_youtube().channels().list(id=channel_id, part='snippet').execute()
+            if ch_info['items']:
+                report["channel_name"] = ch_info['items'][0]['snippet']['title']
+                log(f"Kênh: {report['channel_name']}")
+        except QuotaExhausted: raise
+        except: pass
+        channel_name = report["channel_name"]
+        if RESUME and load_checkpoint(report):
+            log(f"[{channel_name}] Quét tiếp từ checkpoint: bỏ qua {len(report['processed'])} video đã xong")
+        else:
+            open_report_csv(report)
+        processed = set(report["processed"])
+
+        if AUDIT_PROCESSES > 1:
+            run_channel_shards(report, processed)
+        else:
+            run_channel_pipeline(report, lambda: iter_upload_pages(channel_id), processed)
+        log(f"[{channel_name}] Tổng số video dài đã quét: {stats['videos_scanned']}")
+        total_issues_count = stats['links_error'] + stats['endscreen_issues'] + stats['videos_failed'] + stats['comments_skipped']
         elapsed = round(time.time() - start_time, 2)
-        log(f"=== HOÀN TẤT TRONG {elapsed} GIÂY ===")
+        log(f"=== [{channel_name}] HOÀN TẤT TRONG {elapsed} GIÂY ===")
+        log_timing_report(f"[{channel_name}] Thời gian theo bước", scope=channel_id)
+        report["timing_json"] = export_timing_json(os.path.join(REPORT_DIR, f"Thoi_gian_{channel_id}.json"), scope=channel_id,
+                                                   channel_id=channel_id, channel_name=channel_name, elapsed_s=elapsed)
         
-        send_email_with_csv(total_issues_count, current_channel_name)
+        # Ghi checkpoint trước khi gửi email: send_email_with_csv đóng file CSV, save_checkpoint cần file còn mở
+        if quota_blocked() or report.get("quota_blocked"):
+            # Có video chưa quét được vì hết quota -> giữ checkpoint để lượt sau (--resume) quét tiếp phần còn lại
+            log(f"[{channel_name}] Hết quota API giữa chừng, lưu checkpoint để quét tiếp ở lượt sau")
+            save_checkpoint(report)
+        elif stats['videos_failed']:
+            log(f"[{channel_name}] {stats['videos_failed']} mục lỗi khi xử lý, lưu checkpoint để --resume quét lại")
+            save_checkpoint(report)
+        else:
+            remove_checkpoint(report)
+        send_email_with_csv(total_issues_count, channel_name, report=report)
 
     except Exception as e:
         error_msg = traceback.format_exc()
         print("LỖI:", error_msg)
-        send_email_with_csv(0, current_channel_name, crash_message=error_msg)
+        save_checkpoint(report)
+        send_email_with_csv(0, report["channel_name"], crash_message=error_msg, report=report)
+
+def load_channels_config(path):
+    """Đọc danh sách kênh từ file JSON: ["UC...", ...] hoặc [{"id": "UC...", "name": "..."}, ...]"""
+    with open(path, encoding='utf-8') as f:
+        channels = json.load(f)
+    reports = []
+    for channel in channels:
+        if isinstance(channel, str):
+            reports.append(new_channel_report(channel))
+        else:
+            reports.append(new_channel_report(channel['id'], channel.get('name', "Unknown Channel")))
+    return reports
+
+def main():
+    global RESUME
+    # --resume: kênh nào còn checkpoint của lượt trước (bị lỗi/timeout) thì quét tiếp từ đó
+    RESUME = '--resume' in sys.argv[1:]
+    log("=== BẮT ĐẦU QUÉT (FINAL VERSION) ===")
+    start_time = time.time()
+
+    # Có CHANNEL_ID -> quét 1 kênh như cũ; không có thì quét toàn bộ kênh trong CHANNELS_CONFIG
+    if CHANNEL_ID or not CHANNELS_CONFIG:
+        reports = [DEFAULT_REPORT]
+    else:
+        reports = load_channels_config(CHANNELS_CONFIG)
+        log(f"Quét {len(reports)} kênh song song (tối đa {CHANNEL_WORKERS} kênh cùng lúc), dùng chung pool check link và cache")
+
+    try:
+        # Các kênh chạy song song, dùng chung pool check link, cache verdict và memo end screen
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(CHANNEL_WORKERS, len(reports)))) as executor:
+            list(executor.map(audit_channel, reports))
+    finally:
+        shutdown_link_checker()
+        close_api_batcher()
+        shutdown_process_pool()
+        merge_thread_counters()
+        merge_worker_stats()
+        log(f"Chỉ mục video: {VIDEO_INDEX_STATS['reused']} video không đổi (dùng lại), {VIDEO_INDEX_STATS['audited']} video quét mới")
+        log(f"End screen: {ENDSCREEN_API_STATS['targets']} phần tử, {ENDSCREEN_API_STATS['api_calls']} lần gọi API, "
+            f"đọc {WATCH_PAGE_STATS['bytes_read']} byte từ {WATCH_PAGE_STATS['pages']} trang xem video")
+        log_probe_stats()
+        log_timeout_stats()
+        log_dns_stats()
+        log_canonical_stats()
+        log_quota_report()
+        close_link_cache()
+
+    elapsed = round(time.time() - start_time, 2)
+    if len(reports) > 1:
+        log_timing_report("Thời gian theo bước (cả lượt chạy)")
+        export_timing_json(os.path.join(REPORT_DIR, "Thoi_gian_xu_ly.json"), elapsed_s=elapsed)
+    log(f"=== HOÀN TẤT TRONG {elapsed} GIÂY ===")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,136 @@
+import os
+import json
+import math
+import time
+import socket
+import contextlib
+import contextvars
+
+# --- ĐO THỜI GIAN TỪNG BƯỚC (DÙNG CHUNG CHO CÁC SCRIPT) ---
+# Mỗi mẫu là (bước, giây, số byte, phạm vi). Phạm vi = kênh đang quét, None = việc dùng chung (vd lô batch API nhiều kênh).
+# list.append an toàn đa luồng nên các luồng ghi mẫu không cần khóa
+_samples = []
+_timing_scope = contextvars.ContextVar('timing_scope', default=None)
+
+def set_timing_scope(scope):
+    """Gắn các mẫu đo sau đó của luồng/task hiện tại cho `scope` (thường là ID kênh)"""
+    _timing_scope.set(scope)
+
+def get_timing_scope():
+    return _timing_scope.get()
+
+def record_phase(phase, seconds, nbytes=0):
+    _samples.append((phase, seconds, nbytes, _timing_scope.get()))
+
+@contextlib.contextmanager
+def timed(phase):
+    """Đo thời gian khối lệnh; gán sample["bytes"] trong khối để ghi kèm số byte"""
+    sample = {"bytes": 0}
+    started = time.perf_counter()
+    try:
+        yield sample
+    finally:
+        record_phase(phase, time.perf_counter() - started, sample["bytes"])
+
+def timing_mark():
+    """Vị trí hiện tại trong danh sách mẫu, dùng với timing_samples() để lấy mẫu phát sinh sau đó"""
+    return len(_samples)
+
+def timing_samples(since=0):
+    return _samples[since:]
+
+def merge_timing_samples(samples):
+    """Nhận mẫu đo từ tiến trình con"""
+    _samples.extend(samples)
+
+def percentile(sorted_values, pct):
+    """Percentile kiểu nearest-rank trên danh sách đã sắp xếp"""
+    return sorted_values[max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)]
+
+def summarize_timing(scope=None):
+    """Thống kê theo bước (bước tốn nhiều thời gian nhất đứng đầu). scope=None -> mọi mẫu."""
+    durations, nbytes = {}, {}
+    for phase, seconds, size, sample_scope in list(_samples):
+        if scope is not None and sample_scope != scope: continue
+        durations.setdefault(phase, []).append(seconds)
+        nbytes[phase] = nbytes.get(phase, 0) + size
+
+    summary = {}
+    for phase, values in sorted(durations.items(), key=lambda item: -sum(item[1])):
+        values.sort()
+        summary[phase] = {
+            "count": len(values),
+            "total_s": round(sum(values), 3),
+            "p50_ms": round(percentile(values, 50) * 1000, 1),
+            "p95_ms": round(percentile(values, 95) * 1000, 1),
+            "p99_ms": round(percentile(values, 99) * 1000, 1),
+            "max_ms": round(values[-1] * 1000, 1),
+            "bytes": nbytes[phase],
+        }
+    return summary
+
+def format_timing_summary(summary):
+    lines = []
+    for phase, s in summary.items():
+        line = (f"  - {phase}: {s['count']} lần, tổng {s['total_s']} giây, "
+                f"p50 {s['p50_ms']} ms / p95 {s['p95_ms']} ms / p99 {s['p99_ms']} ms, max {s['max_ms']} ms")
+        if s["bytes"]: line += f", {s['bytes']} byte"
+        lines.append(line)
+    return lines
+
+def log_timing_report(title="Thời gian theo bước", scope=None):
+    summary = summarize_timing(scope)
+    if not summary: return
+    print(f"{title}:", flush=True)
+    for line in format_timing_summary(summary):
+        print(line, flush=True)
+
+def export_timing_json(path, scope=None, **extra):
+    """Ghi thống kê ra file JSON (kèm các trường extra như tên kênh, tổng thời gian chạy). Trả về nội dung đã ghi."""
+    content = json.dumps(dict(extra, phases=summarize_timing(scope)), ensure_ascii=False, indent=2)
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+    except OSError as e:
+        print(f"Lỗi ghi file thời gian {path}: {e}", flush=True)
+    return content
+
+# --- ĐO DNS / KẾT NỐI CỦA requests (urllib3) ---
+
+class _TimedSocketModule:
+    """Thay module socket mà urllib3 dùng khi mở kết nối: getaddrinfo được đo (http.dns), còn lại giữ nguyên"""
+    def __init__(self, getaddrinfo=None):
+        self._getaddrinfo = getaddrinfo or socket.getaddrinfo
+
+    def __getattr__(self, name):
+        return getattr(socket, name)
+
+    def getaddrinfo(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._getaddrinfo(*args, **kwargs)
+        finally:
+            record_phase("http.dns", time.perf_counter() - started)
+
+def instrument_urllib3(on_connect=None, getaddrinfo=None):
+    """Đo mỗi lần requests mở kết nối mới: http.dns (phân giải tên) và http.connect (DNS + TCP, chưa gồm TLS).
+    on_connect(host, giây) được gọi thêm sau mỗi lần kết nối thành công (vd để học độ trễ theo host),
+    getaddrinfo thay cho socket.getaddrinfo khi phân giải (vd hàm có cache)."""
+    import urllib3.util.connection as urllib3_connection
+    if getattr(urllib3_connection.create_connection, '_timed', False): return
+    create_connection = urllib3_connection.create_connection
+
+    def timed_create_connection(address, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            sock = create_connection(address, *args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - started
+            record_phase("http.connect", seconds)
+        if on_connect: on_connect(address[0], seconds)
+        return sock
+
+    timed_create_connection._timed = True
+    urllib3_connection.socket = _TimedSocketModule(getaddrinfo)
+    urllib3_connection.create_connection = timed_create_connection
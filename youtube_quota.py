@@ -0,0 +1,374 @@
+import os
+import json
+import time
+import random
+import datetime
+import threading
+import queue
+import concurrent.futures
+try:
+    import fcntl
+except ImportError:  # Windows: không khóa file được, vẫn chạy bình thường
+    fcntl = None
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
+from phase_timing import timed
+
+# --- QUOTA YOUTUBE DATA API (DÙNG CHUNG CHO CÁC SCRIPT) ---
+# Mọi workflow dùng chung 1 API key -> mỗi lần gọi API đều được trừ vào sổ quota theo ngày lưu trên đĩa
+QUOTA_LEDGER = os.environ.get('QUOTA_LEDGER', 'quota_ledger.json')
+QUOTA_DAILY_LIMIT = int(os.environ.get('QUOTA_DAILY_LIMIT', '10000'))
+# Đã dùng quá tỉ lệ này của quota ngày thì hoãn việc ưu tiên thấp (quét comment) để dành quota cho việc chính
+QUOTA_LOW_PRIORITY_SHARE = float(os.environ.get('QUOTA_LOW_PRIORITY_SHARE', '0.8'))
+QUOTA_MAX_RETRIES = int(os.environ.get('QUOTA_MAX_RETRIES', '5'))
+QUOTA_BACKOFF_BASE = float(os.environ.get('QUOTA_BACKOFF_BASE', '1'))
+QUOTA_BACKOFF_MAX = 60
+QUOTA_SAVE_EVERY = 20  # Ghi sổ xuống đĩa sau mỗi N lần gọi (và khi kết thúc lượt chạy)
+
+# Gom các lần gọi API độc lập thành batch HTTP: tối đa API_BATCH_SIZE lệnh/lô, chờ gom tối đa API_BATCH_WAIT giây
+API_BATCH_SIZE = int(os.environ.get('API_BATCH_SIZE', '50'))
+API_BATCH_WAIT = float(os.environ.get('API_BATCH_WAIT', '0.05'))
+API_BATCH_STATS = {"batches": 0, "calls": 0}
+
+# Gửi API (kể cả batch) tới địa chỉ khác thay cho https://youtube.googleapis.com/, vd máy chủ giả lập của benchmarks/
+YOUTUBE_API_ROOT = os.environ.get('YOUTUBE_API_ROOT', '')
+
+# Chi phí (đơn vị quota) theo tài liệu YouTube Data API v3
+METHOD_COSTS = {'list': 1, 'insert': 50, 'update': 50, 'delete': 50}
+ENDPOINT_COSTS = {'search.list': 100}
+LOW_PRIORITY_ENDPOINTS = {'commentThreads.list'}
+RETRY_REASONS = {'quotaExceeded', 'dailyLimitExceeded', 'rateLimitExceeded', 'userRateLimitExceeded'}
+DAILY_LIMIT_REASONS = {'quotaExceeded', 'dailyLimitExceeded'}
+
+# Quota reset lúc 0h giờ Pacific
+try:
+    from zoneinfo import ZoneInfo
+    _QUOTA_TZ = ZoneInfo('America/Los_Angeles')
+except Exception:
+    _QUOTA_TZ = datetime.timezone(datetime.timedelta(hours=-8))
+
+# Thống kê trong lượt chạy: endpoint -> {"calls", "units", "retries", "deferred", "blocked"}
+QUOTA_RUN_STATS = {}
+_ledger = None
+_ledger_unsaved = 0
+# Phần quota dùng thêm từ lần ghi sổ trước, được cộng dồn vào sổ trên đĩa (nhiều tiến trình ghi chung 1 sổ)
+_ledger_delta = {"units": 0, "endpoints": {}}
+_ledger_lock = threading.Lock()
+
+class QuotaExhausted(Exception):
+    """Hết quota ngày (hoặc bị giới hạn tốc độ quá số lần thử lại) -> không gọi API nữa"""
+
+class QuotaDeferred(QuotaExhausted):
+    """Việc ưu tiên thấp bị hoãn vì quota ngày sắp hết"""
+
+def get_quota_day():
+    return datetime.datetime.now(_QUOTA_TZ).strftime('%Y-%m-%d')
+
+def _load_ledger():
+    """Đọc sổ quota của ngày hiện tại (sang ngày mới thì bắt đầu sổ mới). Gọi khi đang giữ _ledger_lock."""
+    global _ledger
+    day = get_quota_day()
+    if _ledger is None:
+        try:
+            with open(QUOTA_LEDGER, encoding='utf-8') as f:
+                _ledger = json.load(f)
+        except (OSError, ValueError):
+            _ledger = {}
+    if _ledger.get("day") != day:
+        _ledger = {"day": day, "units": 0, "endpoints": {}, "exhausted": False}
+        _ledger_delta["units"] = 0
+        _ledger_delta["endpoints"] = {}
+    return _ledger
+
+def _save_ledger():
+    """Đọc lại sổ trên đĩa (đang khóa file), cộng phần dùng thêm của tiến trình này rồi ghi lại -> không mất số của tiến trình khác"""
+    global _ledger, _ledger_unsaved
+    if _ledger is None: return
+    try:
+        with open(QUOTA_LEDGER + ".lock", 'w') as lock_file:
+            if fcntl: fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(QUOTA_LEDGER, encoding='utf-8') as f:
+                    disk = json.load(f)
+            except (OSError, ValueError):
+                disk = {}
+            if disk.get("day") != _ledger["day"]:
+                disk = {"day": _ledger["day"], "units": 0, "endpoints": {}, "exhausted": False}
+            disk["units"] += _ledger_delta["units"]
+            for endpoint, units in _ledger_delta["endpoints"].items():
+                disk["endpoints"][endpoint] = disk["endpoints"].get(endpoint, 0) + units
+            disk["exhausted"] = disk["exhausted"] or _ledger["exhausted"]
+            with open(QUOTA_LEDGER + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump(disk, f)
+            os.replace(QUOTA_LEDGER + ".tmp", QUOTA_LEDGER)
+        _ledger = disk
+        _ledger_delta["units"] = 0
+        _ledger_delta["endpoints"] = {}
+        _ledger_unsaved = 0
+    except OSError as e:
+        print(f"Lỗi ghi sổ quota: {e}", flush=True)
+
+def flush_quota_ledger():
+    with _ledger_lock:
+        _save_ledger()
+
+def _run_stats(endpoint):
+    return QUOTA_RUN_STATS.setdefault(endpoint, {"calls": 0, "units": 0, "retries": 0, "deferred": 0, "blocked": 0})
+
+def quota_blocked():
+    """True nếu trong lượt chạy đã có lần gọi API bị chặn vì hết quota (kết quả quét không đầy đủ)"""
+    with _ledger_lock:
+        return any(s["blocked"] for s in QUOTA_RUN_STATS.values())
+
+def get_call_cost(endpoint):
+    return ENDPOINT_COSTS.get(endpoint, METHOD_COSTS.get(endpoint.rsplit('.', 1)[-1], 1))
+
+def charge_quota(endpoint, cost):
+    """Trừ quota trước khi gọi. Hết quota -> QuotaExhausted, việc ưu tiên thấp gần hết quota -> QuotaDeferred."""
+    global _ledger_unsaved
+    with _ledger_lock:
+        ledger = _load_ledger()
+        if ledger["exhausted"] or ledger["units"] + cost > QUOTA_DAILY_LIMIT:
+            _run_stats(endpoint)["blocked"] += 1
+            raise QuotaExhausted(f"Hết quota ngày {ledger['day']} ({ledger['units']}/{QUOTA_DAILY_LIMIT} đơn vị), bỏ qua {endpoint}")
+        if endpoint in LOW_PRIORITY_ENDPOINTS and ledger["units"] + cost > QUOTA_DAILY_LIMIT * QUOTA_LOW_PRIORITY_SHARE:
+            _run_stats(endpoint)["deferred"] += 1
+            raise QuotaDeferred(f"Quota ngày đã dùng {ledger['units']}/{QUOTA_DAILY_LIMIT}, hoãn {endpoint}")
+        ledger["units"] += cost
+        ledger["endpoints"][endpoint] = ledger["endpoints"].get(endpoint, 0) + cost
+        _ledger_delta["units"] += cost
+        _ledger_delta["endpoints"][endpoint] = _ledger_delta["endpoints"].get(endpoint, 0) + cost
+        stats = _run_stats(endpoint)
+        stats["calls"] += 1
+        stats["units"] += cost
+        _ledger_unsaved += 1
+        if _ledger_unsaved >= QUOTA_SAVE_EVERY: _save_ledger()
+
+def mark_quota_exhausted():
+    """API đã báo hết quota ngày -> các lần gọi sau trong ngày dừng ngay, không tốn request"""
+    with _ledger_lock:
+        _load_ledger()["exhausted"] = True
+        _save_ledger()
+
+def get_error_reason(error):
+    try:
+        return json.loads(error.content.decode('utf-8'))['error']['errors'][0]['reason']
+    except Exception:
+        return ''
+
+def is_retryable_error(error):
+    return error.resp.status == 429 or get_error_reason(error) in RETRY_REASONS
+
+def get_backoff_delay(attempt):
+    """Chờ lũy thừa có jitter (full jitter) trước lần thử lại thứ attempt + 1"""
+    return random.uniform(0, min(QUOTA_BACKOFF_MAX, QUOTA_BACKOFF_BASE * 2 ** attempt))
+
+def record_retry(endpoint):
+    with _ledger_lock:
+        _run_stats(endpoint)["retries"] += 1
+
+def give_up_on_error(error, endpoint, attempts):
+    """Hết số lần thử lại -> trả về QuotaExhausted (API báo hết quota ngày thì khóa sổ cả ngày)"""
+    reason = get_error_reason(error)
+    if reason in DAILY_LIMIT_REASONS: mark_quota_exhausted()
+    with _ledger_lock:
+        _run_stats(endpoint)["blocked"] += 1
+    exhausted = QuotaExhausted(f"{endpoint}: {reason or error.resp.status} sau {attempts} lần thử")
+    exhausted.__cause__ = error
+    return exhausted
+
+def execute_with_quota(request, endpoint, cost=None, **kwargs):
+    """Gọi request.execute() có trừ quota; 429/403 quota/rate limit thì chờ lũy thừa có jitter rồi thử lại"""
+    cost = get_call_cost(endpoint) if cost is None else cost
+    for attempt in range(QUOTA_MAX_RETRIES + 1):
+        charge_quota(endpoint, cost)
+        try:
+            with timed(f"api.{endpoint}"):
+                return request.execute(**kwargs)
+        except HttpError as e:
+            if not is_retryable_error(e): raise
+            if attempt == QUOTA_MAX_RETRIES: raise give_up_on_error(e, endpoint, attempt + 1)
+            record_retry(endpoint)
+            time.sleep(get_backoff_delay(attempt))
+
+class _QuotaRequest:
+    def __init__(self, request, endpoint):
+        self._request = request
+        self._endpoint = endpoint
+
+    def execute(self, **kwargs):
+        return execute_with_quota(self._request, self._endpoint, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._request, name)
+
+class _QuotaResource:
+    def __init__(self, resource, name):
+        self._resource = resource
+        self._name = name
+
+    def __getattr__(self, method_name):
+        method = getattr(self._resource, method_name)
+        # list_next() tạo request trang sau, tính quota như list()
+        endpoint = f"{self._name}.{method_name[:-5] if method_name.endswith('_next') else method_name}"
+
+        def call(*args, **kwargs):
+            args = [a._request if isinstance(a, _QuotaRequest) else a for a in args]
+            request = method(*args, **kwargs)
+            return _QuotaRequest(request, endpoint) if request is not None else None
+        return call
+
+class QuotaAwareYouTube:
+    """Bọc client build('youtube', 'v3'): youtube.videos().list(...).execute() được tính quota tự động"""
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith('new_batch') or not callable(attr): return attr
+        return lambda *args, **kwargs: _QuotaResource(attr(*args, **kwargs), name)
+
+def build_youtube(api_key):
+    if not YOUTUBE_API_ROOT:
+        return QuotaAwareYouTube(build('youtube', 'v3', developerKey=api_key))
+    # Đổi rootUrl ngay trong discovery doc: client_options chỉ đổi URL gọi thường, URL batch vẫn trỏ về Google
+    service = json.loads(get_static_doc('youtube', 'v3'))
+    service['rootUrl'] = service['mtlsRootUrl'] = YOUTUBE_API_ROOT
+    return QuotaAwareYouTube(build_from_document(service, developerKey=api_key))
+
+# --- BATCH HTTP ---
+
+class ApiBatcher:
+    """
+    Gom các lần gọi API độc lập (comment của nhiều video, check end screen...) thành batch HTTP,
+    mỗi lô 1 round trip. submit(build_request) trả về Future; lỗi của lệnh nào chỉ gán cho Future của lệnh đó.
+    build_request(youtube) tạo request trên client của luồng batch (client googleapiclient không an toàn đa luồng).
+    """
+    def __init__(self, client_factory, batch_size=API_BATCH_SIZE, max_wait=API_BATCH_WAIT):
+        self._client_factory = client_factory
+        self._batch_size = max(1, min(batch_size, 1000))  # Google giới hạn 1000 lệnh/batch
+        self._max_wait = max_wait
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._error = None  # Lỗi làm luồng batch dừng hẳn; sau đó submit trả về Future lỗi ngay
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, build_request):
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._error is None:
+                self._queue.put((build_request, future, 0))
+                return future
+        future.set_exception(self._error)
+        return future
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        calls, retry_calls = [], []
+        try:
+            self._loop(calls, retry_calls)
+        except Exception as e:
+            print(f"Luồng batch API dừng vì lỗi: {type(e).__name__}: {e}", flush=True)
+            self._fail(e, calls + retry_calls)
+
+    def _fail(self, error, calls):
+        """Gán lỗi cho mọi lệnh đang giữ hoặc còn trong hàng đợi, từ đó submit không xếp thêm lệnh vào luồng đã dừng"""
+        with self._lock:
+            self._error = error
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None: calls.append(item)
+        for _, future, _ in calls:
+            if not future.done(): future.set_exception(error)
+
+    def _loop(self, calls, retry_calls):
+        """calls/retry_calls là list dùng chung với _run để còn biết lệnh nào chưa có kết quả khi có lỗi"""
+        client = self._client_factory()
+        closing = False
+        while True:
+            calls[:], retry_calls[:] = retry_calls[:self._batch_size], retry_calls[self._batch_size:]
+            if calls: time.sleep(get_backoff_delay(max(attempt for _, _, attempt in calls) - 1))
+            deadline = time.monotonic() + self._max_wait
+            # Chờ lệnh đầu tiên, sau đó gom thêm tới khi đủ lô hoặc hết thời gian chờ
+            while not closing and len(calls) < self._batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()) if calls else None)
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                if not calls: deadline = time.monotonic() + self._max_wait
+                calls.append(item)
+            if calls:
+                retry_calls.extend(self._execute(client, calls))
+                calls.clear()
+            elif closing:
+                return
+
+    def _execute(self, client, calls):
+        """Gửi 1 batch, trả về các lệnh bị 429/quota cần thử lại ở lô sau"""
+        live = {}
+        retry_calls = []
+
+        def callback(request_id, response, exception):
+            build_request, future, attempt, endpoint = live[request_id]
+            if exception is None:
+                future.set_result(response)
+                return
+            if isinstance(exception, HttpError) and is_retryable_error(exception):
+                if attempt < QUOTA_MAX_RETRIES:
+                    record_retry(endpoint)
+                    retry_calls.append((build_request, future, attempt + 1))
+                    return
+                exception = give_up_on_error(exception, endpoint, attempt + 1)
+            future.set_exception(exception)
+
+        batch = client.new_batch_http_request(callback=callback)
+        for build_request, future, attempt in calls:
+            try:
+                request = build_request(client)
+                charge_quota(request._endpoint, get_call_cost(request._endpoint))
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            request_id = str(len(live))
+            live[request_id] = (build_request, future, attempt, request._endpoint)
+            batch.add(request._request, request_id=request_id)
+        if not live: return []
+
+        try:
+            # 1 mẫu/lô: các lệnh trong lô đi chung 1 round trip
+            with timed("api.batch"):
+                batch.execute()
+        except Exception as e:
+            # Lỗi cả lô (mạng...) -> mọi lệnh chưa có kết quả trong lô đều nhận lỗi này
+            for _, future, _, _ in live.values():
+                if not future.done(): future.set_exception(e)
+            return []
+        with _ledger_lock:
+            API_BATCH_STATS["batches"] += 1
+            API_BATCH_STATS["calls"] += len(live)
+        return retry_calls
+
+def log_quota_report():
+    """Ghi sổ xuống đĩa và in số đơn vị quota đã dùng theo từng endpoint trong lượt chạy"""
+    with _ledger_lock:
+        _load_ledger()
+        _save_ledger()
+        ledger = _ledger
+        run_units = sum(s["units"] for s in QUOTA_RUN_STATS.values())
+        print(f"Quota API: lượt này dùng {run_units} đơn vị, hôm nay ({ledger['day']}) đã dùng {ledger['units']}/{QUOTA_DAILY_LIMIT}"
+              + (" - ĐÃ HẾT QUOTA" if ledger["exhausted"] else ""), flush=True)
+        if API_BATCH_STATS["batches"]:
+            print(f"Batch API: {API_BATCH_STATS['calls']} lệnh gửi trong {API_BATCH_STATS['batches']} lô", flush=True)
+        for endpoint, s in sorted(QUOTA_RUN_STATS.items(), key=lambda item: -item[1]["units"]):
+            print(f"  - {endpoint}: {s['calls']} lần gọi, {s['units']} đơn vị, {s['retries']} lần thử lại, {s['deferred']} lần hoãn, {s['blocked']} lần bị chặn", flush=True)